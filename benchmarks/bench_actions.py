@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+
+"""Action benchmark: API round trips, bytes and latency of start/stop/check against the
+offline stand-in of the zabbix API (benchmarks/fake_zabbix.py)
+
+Every run of an action uses a new client, like one invocation of the scripts
+(login and logout are included)."""
+
+import argparse
+import json
+import math
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# pylint: disable=wrong-import-position
+from fake_zabbix import FakeZabbix
+from zabbix_maintenance_lib import ZabbixClient, run_action, run_bulk
+
+# (label, action, period in hours), run in this order so every run ends without maintenances
+ACTIONS = [
+    ("start (create)", "start", 2),
+    ("start (covered)", "start", 1),
+    ("start (extend)", "start", 3),
+    ("check", "check", 1),
+    ("stop", "stop", 1),
+]
+
+
+def percentile(samples, percent):
+    """nearest-rank percentile"""
+    ordered = sorted(samples)
+    return ordered[max(0, math.ceil(percent / 100 * len(ordered)) - 1)]
+
+
+def run_scenario(fake, hosts, repeat):
+    """run all actions 'repeat' times on 'hosts', returns a list of result dicts"""
+    samples = {label: [] for label, _, _ in ACTIONS}
+    failed = {label: 0 for label, _, _ in ACTIONS}
+    round_trips = {}
+    for _ in range(repeat):
+        for label, action, hours in ACTIONS:
+            fake.reset_stats()
+            started = time.perf_counter()
+            with ZabbixClient("fake", "benchmark", "benchmark", url=fake.url) as client:
+                if len(hosts) == 1:
+                    result = run_action(
+                        client, action, hosts[0], "bench", int(hours * 3600)
+                    )
+                else:
+                    result = run_bulk(client, action, hosts, "bench", int(hours * 3600))
+            samples[label].append(time.perf_counter() - started)
+            if result.exit_code != 0:
+                failed[label] += 1
+            round_trips[label] = fake.summary()
+    return [
+        {
+            "action": label,
+            "round_trips": round_trips[label][0],
+            "request_bytes": round_trips[label][1],
+            "response_bytes": round_trips[label][2],
+            "p50_ms": round(statistics.median(samples[label]) * 1000, 3),
+            "p99_ms": round(percentile(samples[label], 99) * 1000, 3),
+            "failed": failed[label],
+        }
+        for label, _, _ in ACTIONS
+    ]
+
+
+def main():
+    """run the benchmark"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--hosts",
+        type=int,
+        default=10000,
+        help="Number of hosts on the stand-in and in the bulk scenario (default 10000)",
+    )
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=0.0,
+        help="Injected latency per API call in seconds (default 0)",
+    )
+    parser.add_argument(
+        "--jitter",
+        type=float,
+        default=0.0,
+        help="Random extra latency per API call in seconds (default 0)",
+    )
+    parser.add_argument(
+        "--error-rate",
+        type=float,
+        default=0.0,
+        help='Share of the API calls answered with "503 Service Unavailable" (default 0)',
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=20,
+        help="Runs of each action in the single host scenario (default 20)",
+    )
+    parser.add_argument(
+        "--bulk-repeat",
+        type=int,
+        default=3,
+        help="Runs of each action in the bulk scenario (default 3)",
+    )
+    parser.add_argument(
+        "--json", action="store_true", help="Print the results as JSON lines"
+    )
+    args = parser.parse_args()
+
+    with FakeZabbix(
+        args.hosts, args.latency, args.jitter, error_rate=args.error_rate
+    ) as fake:
+        hostnames = [h["host"] for h in fake.hosts.values()]
+        scenarios = [
+            ("single-host", hostnames[:1], args.repeat),
+            (f"{len(hostnames)}-host", hostnames, args.bulk_repeat),
+        ]
+        if args.json:
+            for scenario, hosts, repeat in scenarios:
+                for row in run_scenario(fake, hosts, repeat):
+                    print(json.dumps({"scenario": scenario, **row}), flush=True)
+            return
+        print(
+            f"{'scenario':<12} {'action':<16} {'round trips':>11} {'sent':>10} "
+            f"{'received':>10} {'p50 ms':>9} {'p99 ms':>9} {'failed':>6}"
+        )
+        for scenario, hosts, repeat in scenarios:
+            for row in run_scenario(fake, hosts, repeat):
+                print(
+                    f"{scenario:<12} {row['action']:<16} {row['round_trips']:>11} "
+                    f"{row['request_bytes']:>10} {row['response_bytes']:>10} "
+                    f"{row['p50_ms']:>9.1f} {row['p99_ms']:>9.1f} {row['failed']:>6}",
+                    flush=True,
+                )
+
+
+if __name__ == "__main__":
+    main()
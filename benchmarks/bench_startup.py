@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+
+"""Startup benchmark: time from the process start to the first API call of the scripts"""
+
+import argparse
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from fake_zabbix import FakeZabbix
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run_once(fake, command, env, cwd):
+    """run the command once, returns (time to first API call, total time) in seconds"""
+    fake.reset_stats()
+    started = time.perf_counter()
+    subprocess.run(command, env=env, cwd=cwd, stdout=subprocess.DEVNULL, check=False)
+    finished = time.perf_counter()
+    if not fake.calls:
+        return None, finished - started
+    return fake.calls[0].arrived - started, finished - started
+
+
+def report(label, samples):
+    """print min/median/max of the samples in milliseconds"""
+    first_calls = [first for first, _ in samples if first is not None]
+    totals = [total for _, total in samples]
+    if not first_calls:
+        print(f"{label}: no API call was made")
+        return
+    print(
+        f"{label}: first API call min {min(first_calls) * 1000:.1f} ms, "
+        f"median {statistics.median(first_calls) * 1000:.1f} ms, "
+        f"max {max(first_calls) * 1000:.1f} ms; "
+        f"total median {statistics.median(totals) * 1000:.1f} ms"
+    )
+
+
+def main():
+    """run the benchmark"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--runs", "-n", type=int, default=10, help="Number of runs (default 10)"
+    )
+    parser.add_argument(
+        "--exe",
+        type=str,
+        default=None,
+        help="Benchmark this executable (the PyInstaller build of zabbix_maintenance.py) "
+        "instead of the script",
+    )
+    parser.add_argument(
+        "--legacy",
+        action="store_true",
+        help="Benchmark zabbix_maintenance.py instead of zabbix_maintenance_v7.py",
+    )
+    args = parser.parse_args()
+
+    fake = FakeZabbix(hosts=1)
+    fake.start()
+
+    workdir = tempfile.mkdtemp(prefix="zabbix_maintenance_bench_")
+    try:
+        config_file = os.path.join(workdir, "zabbix_maintenance.yml")
+        with open(config_file, "w", encoding="utf-8") as ymlfile:
+            ymlfile.write(
+                "user: 'benchmark'\n"
+                "password: 'benchmark'\n"
+                "server: 'benchmark'\n"
+                f"url: '{fake.url}'\n"
+            )
+        # zabbix_maintenance.py reads the config from the working directory
+        if args.exe:
+            command = [args.exe, "check"]
+        elif args.legacy:
+            command = [
+                sys.executable,
+                os.path.join(ROOT, "zabbix_maintenance.py"),
+                "check",
+            ]
+        else:
+            command = [
+                sys.executable,
+                os.path.join(ROOT, "zabbix_maintenance_v7.py"),
+                "check",
+                "-c",
+                config_file,
+            ]
+        env = dict(os.environ, ZABBIX_MAINTENANCE_CACHE=os.path.join(workdir, "cache"))
+
+        cold = []
+        for _ in range(args.runs):
+            shutil.rmtree(env["ZABBIX_MAINTENANCE_CACHE"], ignore_errors=True)
+            cold.append(run_once(fake, command, env, workdir))
+        warm = [run_once(fake, command, env, workdir) for _ in range(args.runs)]
+        report("cold cache", cold)
+        report("warm cache", warm)
+    finally:
+        fake.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
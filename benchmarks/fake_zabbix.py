@@ -0,0 +1,630 @@
+#!/usr/bin/env python3
+
+"""Offline stand-in for the zabbix JSON-RPC API
+
+Implements the methods used by the scripts (apiinfo.version, user.login/logout, host.get,
+hostgroup.get, template.get and maintenance.get/create/update/delete) on an in-memory dataset, with injected latency and
+per-call statistics. It can be used in-process:
+
+    with FakeZabbix(hosts=10000, latency=0.005) as fake:
+        client = ZabbixClient("fake", "user", "password", url=fake.url)
+
+or started standalone to point a config file ("url") at it:
+
+    python benchmarks/fake_zabbix.py --hosts 10000 --latency 0.005 --port 8765
+"""
+
+import argparse
+import fnmatch
+import itertools
+import json
+import random
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+TIMEPERIOD_DEFAULTS = {
+    "timeperiod_type": "0",
+    "every": "1",
+    "month": "0",
+    "dayofweek": "0",
+    "day": "0",
+    "start_time": "0",
+    "period": "3600",
+}
+
+# maintenance.get of zabbix sorts only by these fields
+MAINTENANCE_SORT_FIELDS = ("maintenanceid", "name", "maintenance_type")
+
+
+class ApiError(Exception):
+    """JSON-RPC error of the stand-in"""
+
+    def __init__(self, data, code=-32602, message="Invalid params."):
+        super().__init__(data)
+        self.code = code
+        self.message = message
+        self.data = data
+
+
+@dataclass
+class Call:
+    """statistics of one API call"""
+
+    method: str
+    arrived: float
+    request_bytes: int
+    response_bytes: int
+    seconds: float
+
+
+def as_list(value):
+    """API parameters accept a single value or a list"""
+    if value is None:
+        return None
+    return value if isinstance(value, list) else [value]
+
+
+def project(obj, output):
+    """apply the "output" parameter to an object"""
+    if output in (None, "extend"):
+        return dict(obj)
+    return {key: obj[key] for key in as_list(output) if key in obj}
+
+
+def name_matches(name, pattern, start_search, wildcards):
+    """case insensitive name search like the zabbix API"""
+    name = name.lower()
+    pattern = pattern.lower()
+    if wildcards:
+        return fnmatch.fnmatchcase(name, pattern)
+    if start_search:
+        return name.startswith(pattern)
+    return pattern in name
+
+
+class FakeZabbix:
+    """in-memory zabbix API with 'hosts' generated hosts ("host<n>.example.com"),
+    all hosts are in the host group "Linux servers" and every 100 hosts share
+    a host group "group<n>" and a template "template<n>" """
+
+    def __init__(
+        self,
+        hosts=100,
+        latency=0.0,
+        jitter=0.0,
+        api_token=None,
+        error_rate=0.0,
+        workers=None,
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        # share of the requests answered with "503 Service Unavailable"
+        self.error_rate = error_rate
+        # like the PHP-FPM workers of a frontend: at most 'workers' requests are processed
+        # at the same time, the others wait
+        self.workers = threading.Semaphore(workers) if workers else None
+        self.hosts = {
+            str(10001 + i): {"hostid": str(10001 + i), "host": f"host{i}.example.com"}
+            for i in range(hosts)
+        }
+        self.hostids = {h["host"]: hostid for hostid, h in self.hosts.items()}
+        self.groups = {"2": {"groupid": "2", "name": "Linux servers"}}
+        self.group_hosts = {"2": list(self.hosts)}
+        self.templates = {}
+        self.template_hosts = {}
+        for n in range((hosts + 99) // 100):
+            members = [
+                str(10001 + i) for i in range(n * 100, min(hosts, n * 100 + 100))
+            ]
+            self.groups[str(100 + n)] = {"groupid": str(100 + n), "name": f"group{n}"}
+            self.group_hosts[str(100 + n)] = members
+            self.templates[str(200000 + n)] = {
+                "templateid": str(200000 + n),
+                "host": f"template{n}",
+            }
+            self.template_hosts[str(200000 + n)] = members
+        self.maintenances = {}
+        self.maintenances_by_host = {}
+        self.maintenance_names = {}
+        self.next_id = itertools.count(1)
+        self.tokens = {api_token} if api_token else set()
+        self.lock = threading.Lock()
+        self.calls = []
+        self.server = None
+
+    # --- statistics ---
+
+    def reset_stats(self):
+        """forget the recorded calls"""
+        with self.lock:
+            self.calls = []
+
+    def summary(self):
+        """return (round trips, request bytes, response bytes) of the recorded calls"""
+        with self.lock:
+            calls = list(self.calls)
+        return (
+            len(calls),
+            sum(c.request_bytes for c in calls),
+            sum(c.response_bytes for c in calls),
+        )
+
+    # --- HTTP server ---
+
+    @property
+    def url(self):
+        """URL of the API while the server is running"""
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/api_jsonrpc.php"
+
+    def start(self, port=0):
+        """serve the API on 127.0.0.1:'port' (0 is any free port) in a thread"""
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            """JSON-RPC over HTTP"""
+
+            protocol_version = "HTTP/1.1"
+            # headers and body are written separately, avoid the delayed ACK stall
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):  # pylint: disable=arguments-differ
+                pass
+
+            def do_POST(self):  # pylint: disable=invalid-name
+                """answer one JSON-RPC request"""
+                arrived = time.perf_counter()
+                body = self.rfile.read(int(self.headers["Content-Length"]))
+                if fake.workers is not None:
+                    fake.workers.acquire()
+                try:
+                    if fake.latency or fake.jitter:
+                        time.sleep(fake.latency + random.uniform(0, fake.jitter))
+                    if random.random() < fake.error_rate:
+                        method, status, response = "unavailable", 503, b""
+                    else:
+                        method, response = fake.handle_raw(body)
+                        status = 200
+                finally:
+                    if fake.workers is not None:
+                        fake.workers.release()
+                try:
+                    self.send_response(status)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(response)))
+                    self.end_headers()
+                    self.wfile.write(response)
+                except (BrokenPipeError, ConnectionResetError):
+                    # the client gave up (timeout or hedged request)
+                    self.close_connection = True
+                with fake.lock:
+                    fake.calls.append(
+                        Call(
+                            method,
+                            arrived,
+                            len(body),
+                            len(response),
+                            time.perf_counter() - arrived,
+                        )
+                    )
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self.url
+
+    def stop(self):
+        """stop the HTTP server"""
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    # --- JSON-RPC ---
+
+    def handle_raw(self, body):
+        """answer an encoded request, returns (method, encoded response)"""
+        try:
+            request = json.loads(body)
+        except ValueError:
+            request = {}
+        method = str(request.get("method"))
+        return method, json.dumps(self.handle(request)).encode("utf-8")
+
+    def handle(self, request):
+        """answer a decoded JSON-RPC request"""
+        method = request.get("method")
+        params = request.get("params")
+        response = {"jsonrpc": "2.0", "id": request.get("id")}
+        handler = getattr(self, "api_" + str(method).replace(".", "_"), None)
+        try:
+            if handler is None:
+                raise ApiError(
+                    f'Incorrect API "{method}".', -32601, "Method not found."
+                )
+            if method not in ("apiinfo.version", "user.login"):
+                self.check_auth(request.get("auth"))
+            with self.lock:
+                response["result"] = handler(params)
+        except ApiError as err:
+            response["error"] = {
+                "code": err.code,
+                "message": err.message,
+                "data": err.data,
+            }
+        return response
+
+    def check_auth(self, auth):
+        """raise like zabbix for an unknown session"""
+        if auth not in self.tokens:
+            raise ApiError("Session terminated, re-login, please.")
+
+    def api_apiinfo_version(self, params):  # pylint: disable=unused-argument
+        """API version"""
+        return "7.0.0"
+
+    def api_user_login(self, params):
+        """accept any user name and password, "user" or "username" """
+        params = params or {}
+        if "password" not in params or not ("username" in params or "user" in params):
+            raise ApiError(
+                'Invalid parameter "/": the parameter "username" is missing.'
+            )
+        token = uuid.uuid4().hex
+        self.tokens.add(token)
+        return token
+
+    def api_user_logout(self, params):  # pylint: disable=unused-argument
+        """logout is accepted for every session"""
+        return True
+
+    def api_host_get(self, params):
+        """host.get with "filter" on host, "hostids", "output", "selectMaintenances",
+        "sortfield" and "limit" """
+        params = params or {}
+        names = as_list((params.get("filter") or {}).get("host"))
+        hostids = as_list(params.get("hostids"))
+        if names is not None:
+            found = [self.hostids[name] for name in names if name in self.hostids]
+        else:
+            found = list(self.hosts)
+        if hostids is not None:
+            wanted = {str(hostid) for hostid in hostids}
+            found = [hostid for hostid in found if hostid in wanted]
+        hosts = [self.hosts[hostid] for hostid in found]
+        if params.get("sortfield"):
+            hosts.sort(key=lambda h: h.get(params["sortfield"]))
+        if params.get("limit"):
+            hosts = hosts[: int(params["limit"])]
+        result = []
+        for host in hosts:
+            obj = project(host, params.get("output"))
+            if params.get("selectMaintenances") is not None:
+                # like zabbix only the maintenances of the host itself, not of its groups
+                obj["maintenances"] = [
+                    project(
+                        {
+                            key: value
+                            for key, value in self.maintenances[m].items()
+                            if key not in ("hostids", "groupids", "timeperiods")
+                        },
+                        params["selectMaintenances"],
+                    )
+                    | {"maintenanceid": m}
+                    for m in sorted(
+                        self.maintenances_by_host.get(host["hostid"], ()), key=int
+                    )
+                ]
+            result.append(obj)
+        return result
+
+    def api_hostgroup_get(self, params):
+        """hostgroup.get with "groupids", "filter" on name and groupid, "searchByAny"
+        and "output" """
+        params = params or {}
+        groupids = as_list(params.get("groupids"))
+        filters = {
+            key: {str(v) for v in as_list(value)}
+            for key, value in (params.get("filter") or {}).items()
+        }
+        groups = []
+        for groupid, group in self.groups.items():
+            if groupids is not None and groupid not in {str(g) for g in groupids}:
+                continue
+            matches = [group.get(key) in values for key, values in filters.items()]
+            if matches and not (any if params.get("searchByAny") else all)(matches):
+                continue
+            groups.append(project(group, params.get("output")))
+        return groups
+
+    def api_template_get(self, params):
+        """template.get with "filter" on host, "output" and "selectHosts" """
+        params = params or {}
+        names = as_list((params.get("filter") or {}).get("host"))
+        templates = []
+        for templateid, template in self.templates.items():
+            if names is not None and template["host"] not in names:
+                continue
+            obj = project(template, params.get("output"))
+            if params.get("selectHosts") is not None:
+                obj["hosts"] = [
+                    project(self.hosts[hostid], params["selectHosts"])
+                    for hostid in self.template_hosts[templateid]
+                ]
+            templates.append(obj)
+        return templates
+
+    def api_maintenance_get(self, params):
+        """maintenance.get with "maintenanceids", "hostids", "groupids", "filter" and "search"
+        on name, "output", "selectHosts", "selectGroups", "selectTimeperiods", "sortfield"
+        and "limit" """
+        params = params or {}
+        sortfield = params.get("sortfield")
+        if sortfield and sortfield not in MAINTENANCE_SORT_FIELDS:
+            raise ApiError(f'Sorting by field "{sortfield}" not allowed.')
+        maintenanceids = as_list(params.get("maintenanceids"))
+        hostids = as_list(params.get("hostids"))
+        if maintenanceids is not None:
+            found = [str(m) for m in maintenanceids if str(m) in self.maintenances]
+        elif hostids is not None:
+            found = set()
+            for hostid in hostids:
+                found.update(self.maintenances_by_host.get(str(hostid), ()))
+            found = sorted(found, key=int)
+        else:
+            found = list(self.maintenances)
+        if maintenanceids is not None and hostids is not None:
+            wanted = {str(hostid) for hostid in hostids}
+            found = [m for m in found if wanted & set(self.maintenances[m]["hostids"])]
+        groupids = as_list(params.get("groupids"))
+        if groupids is not None:
+            wanted = {str(groupid) for groupid in groupids}
+            found = [m for m in found if wanted & set(self.maintenances[m]["groupids"])]
+        names = as_list((params.get("filter") or {}).get("name"))
+        if names is not None:
+            found = [m for m in found if self.maintenances[m]["name"] in names]
+        patterns = as_list((params.get("search") or {}).get("name"))
+        if patterns is not None:
+            found = [
+                m
+                for m in found
+                if any(
+                    name_matches(
+                        self.maintenances[m]["name"],
+                        pattern,
+                        params.get("startSearch"),
+                        params.get("searchWildcardsEnabled"),
+                    )
+                    for pattern in patterns
+                )
+            ]
+        result = []
+        for maintenanceid in found:
+            stored = self.maintenances[maintenanceid]
+            obj = {
+                key: value
+                for key, value in stored.items()
+                if key not in ("hostids", "groupids", "timeperiods")
+            }
+            obj = project(obj, params.get("output"))
+            obj["maintenanceid"] = maintenanceid
+            if params.get("selectHosts") is not None:
+                obj["hosts"] = [
+                    project(self.hosts[hostid], params["selectHosts"])
+                    for hostid in stored["hostids"]
+                ]
+            if params.get("selectGroups") is not None:
+                obj["groups"] = [
+                    project(self.groups[g], params["selectGroups"])
+                    for g in stored["groupids"]
+                ]
+            if params.get("selectTimeperiods") is not None:
+                obj["timeperiods"] = [
+                    project(tp, params["selectTimeperiods"])
+                    for tp in stored["timeperiods"]
+                ]
+            result.append(obj)
+        if sortfield == "maintenanceid":
+            result.sort(key=lambda m: int(m["maintenanceid"]))
+        elif sortfield == "name":
+            result.sort(key=lambda m: self.maintenances[m["maintenanceid"]]["name"])
+        elif sortfield:
+            result.sort(
+                key=lambda m: int(self.maintenances[m["maintenanceid"]][sortfield])
+            )
+        if sortfield:
+            if params.get("sortorder") == "DESC":
+                result.reverse()
+        if params.get("limit"):
+            result = result[: int(params["limit"])]
+        return result
+
+    def store_maintenance(self, maintenanceid, data):
+        """validate and store a created or updated maintenance"""
+        for hostid in data["hostids"]:
+            if hostid not in self.hosts:
+                raise ApiError(
+                    "No permissions to referred object or it does not exist!"
+                )
+        for groupid in data["groupids"]:
+            if groupid not in self.groups:
+                raise ApiError(
+                    "No permissions to referred object or it does not exist!"
+                )
+        if not data["hostids"] and not data["groupids"]:
+            raise ApiError("At least one host group or host must be selected.")
+        if not data["timeperiods"]:
+            raise ApiError("At least one maintenance period must be created.")
+        if self.maintenance_names.get(data["name"], maintenanceid) != maintenanceid:
+            raise ApiError(f'Maintenance "{data["name"]}" already exists.')
+        old = self.maintenances.get(maintenanceid)
+        if old is not None:
+            del self.maintenance_names[old["name"]]
+            for hostid in old["hostids"]:
+                self.maintenances_by_host[hostid].discard(maintenanceid)
+        self.maintenances[maintenanceid] = data
+        self.maintenance_names[data["name"]] = maintenanceid
+        for hostid in data["hostids"]:
+            self.maintenances_by_host.setdefault(hostid, set()).add(maintenanceid)
+
+    @staticmethod
+    def timeperiods(timeperiods, active_since):
+        """timeperiods as stored by zabbix (all fields as strings)"""
+        result = []
+        for tp in as_list(timeperiods) or []:
+            stored = dict(TIMEPERIOD_DEFAULTS, start_date=str(active_since))
+            stored.update({key: str(value) for key, value in tp.items()})
+            result.append(stored)
+        return result
+
+    def api_maintenance_create(self, params):
+        """maintenance.create of one or more maintenances"""
+        # check all maintenances first, zabbix creates all or none
+        created = []
+        names = set()
+        for m in as_list(params):
+            data = {
+                "name": m["name"],
+                "active_since": str(m.get("active_since", 0)),
+                "active_till": str(m.get("active_till", 0)),
+                "maintenance_type": str(m.get("maintenance_type", 0)),
+                "description": m.get("description", ""),
+                "hostids": [str(h) for h in m.get("hostids", [])],
+                "groupids": [str(g) for g in m.get("groupids", [])],
+                "timeperiods": self.timeperiods(
+                    m.get("timeperiods"), m.get("active_since", 0)
+                ),
+            }
+            if data["name"] in names:
+                raise ApiError(f'Maintenance "{data["name"]}" already exists.')
+            names.add(data["name"])
+            created.append(data)
+        backup = self.snapshot()
+        maintenanceids = []
+        try:
+            for data in created:
+                maintenanceid = str(next(self.next_id))
+                self.store_maintenance(maintenanceid, data)
+                maintenanceids.append(maintenanceid)
+        except ApiError:
+            self.restore(backup)
+            raise
+        return {"maintenanceids": maintenanceids}
+
+    def api_maintenance_update(self, params):
+        """maintenance.update of one or more maintenances"""
+        backup = self.snapshot()
+        maintenanceids = []
+        try:
+            for m in as_list(params):
+                maintenanceid = str(m.get("maintenanceid"))
+                if maintenanceid not in self.maintenances:
+                    raise ApiError(
+                        "No permissions to referred object or it does not exist!"
+                    )
+                data = dict(self.maintenances[maintenanceid])
+                for key in ("name", "description"):
+                    if key in m:
+                        data[key] = m[key]
+                for key in ("active_since", "active_till", "maintenance_type"):
+                    if key in m:
+                        data[key] = str(m[key])
+                if "hostids" in m:
+                    data["hostids"] = [str(h) for h in m["hostids"]]
+                if "groupids" in m:
+                    data["groupids"] = [str(g) for g in m["groupids"]]
+                if "timeperiods" in m:
+                    data["timeperiods"] = self.timeperiods(
+                        m["timeperiods"], data["active_since"]
+                    )
+                self.store_maintenance(maintenanceid, data)
+                maintenanceids.append(maintenanceid)
+        except ApiError:
+            self.restore(backup)
+            raise
+        return {"maintenanceids": maintenanceids}
+
+    def api_maintenance_delete(self, params):
+        """maintenance.delete of a list of maintenance ids"""
+        maintenanceids = [str(m) for m in as_list(params) or []]
+        for maintenanceid in maintenanceids:
+            if maintenanceid not in self.maintenances:
+                raise ApiError(
+                    "No permissions to referred object or it does not exist!"
+                )
+        for maintenanceid in maintenanceids:
+            data = self.maintenances.pop(maintenanceid)
+            del self.maintenance_names[data["name"]]
+            for hostid in data["hostids"]:
+                self.maintenances_by_host[hostid].discard(maintenanceid)
+        return {"maintenanceids": maintenanceids}
+
+    def snapshot(self):
+        """copy of the maintenances and their indexes, to roll back a failed write"""
+        return (
+            dict(self.maintenances),
+            {hostid: set(ids) for hostid, ids in self.maintenances_by_host.items()},
+            dict(self.maintenance_names),
+        )
+
+    def restore(self, snapshot):
+        """roll back to a snapshot"""
+        self.maintenances, self.maintenances_by_host, self.maintenance_names = snapshot
+
+
+def main():
+    """run the stand-in until it is interrupted"""
+    parser = argparse.ArgumentParser(description="Offline stand-in for the zabbix API")
+    parser.add_argument("--port", type=int, default=8765, help="Port (default 8765)")
+    parser.add_argument(
+        "--hosts", type=int, default=100, help="Number of hosts (default 100)"
+    )
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="Latency per call in seconds"
+    )
+    parser.add_argument(
+        "--jitter", type=float, default=0.0, help="Random extra latency in seconds"
+    )
+    parser.add_argument(
+        "--error-rate",
+        type=float,
+        default=0.0,
+        help='Share of the requests answered with "503 Service Unavailable" (0..1)',
+    )
+    parser.add_argument(
+        "--api-token", type=str, default=None, help="Accept this API token"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Process at most this many requests at the same time (default unlimited)",
+    )
+    args = parser.parse_args()
+    fake = FakeZabbix(
+        args.hosts,
+        args.latency,
+        args.jitter,
+        args.api_token,
+        args.error_rate,
+        args.workers,
+    )
+    print(f"Serving {args.hosts} hosts on {fake.start(args.port)}", flush=True)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        fake.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,34 @@
+"""shared fixtures: an in-process FakeZabbix (benchmarks/fake_zabbix.py) and a client for it"""
+
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, "benchmarks")]
+
+# pylint: disable=wrong-import-position
+from fake_zabbix import FakeZabbix  # noqa: E402
+from zabbix_maintenance_lib import ZabbixClient  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def no_local_cache(monkeypatch):
+    """the tests do not read or write the local cache of the user"""
+    monkeypatch.setenv("ZABBIX_MAINTENANCE_CACHE", "")
+
+
+@pytest.fixture
+def fake():
+    """in-process FakeZabbix with 10 hosts"""
+    with FakeZabbix(10) as server:
+        yield server
+
+
+@pytest.fixture
+def client(fake):  # pylint: disable=redefined-outer-name
+    """ZabbixClient logged in to 'fake'"""
+    api = ZabbixClient("fake", "user", "password", url=fake.url, retries=0)
+    yield api
+    api.close()
@@ -0,0 +1,160 @@
+"""plan_reconcile and reconcile against the FakeZabbix"""
+
+from zabbix_maintenance_lib import (
+    Maintenance,
+    maintenance_name,
+    plan_reconcile,
+    reconcile,
+    reconcile_description,
+)
+
+SINCE = 1_800_000_000
+
+
+def desired(host, hostid, keyword="apt", since=SINCE, period=3600):
+    """desired maintenance with a resolved hostid"""
+    return {
+        "kind": "host",
+        "targets": [host],
+        "name": maintenance_name(host, keyword),
+        "since": since,
+        "till": since + period,
+        "period": period,
+        "hostids": [hostid],
+    }
+
+
+def existing(maintenanceid, name, hostid, since=SINCE, period=3600, description=""):
+    """Maintenance like maintenance.get returns it"""
+    return Maintenance(
+        maintenanceid=maintenanceid,
+        name=name,
+        active_since=since,
+        active_till=since + period,
+        timeperiods=[
+            {"timeperiod_type": "0", "start_date": str(since), "period": str(period)}
+        ],
+        hostids=[hostid],
+        description=description,
+    )
+
+
+def test_plan_create_update_unchanged():
+    owned = reconcile_description("apt")
+    plan = plan_reconcile(
+        [
+            desired("a", "1"),
+            desired("b", "2"),
+            desired("c", "3", period=7200),
+        ],
+        [
+            existing("11", maintenance_name("b", "apt"), "2", description=owned),
+            existing("12", maintenance_name("c", "apt"), "3", description=owned),
+        ],
+        "apt",
+    )
+    assert [p["name"] for p in plan.create] == [maintenance_name("a", "apt")]
+    assert plan.create[0]["description"] == owned
+    assert [p["maintenanceid"] for p in plan.update] == ["12"]
+    assert plan.update[0]["active_till"] == SINCE + 7200
+    assert plan.unchanged == [maintenance_name("b", "apt")]
+    assert not plan.delete
+    assert plan.api_calls == 2
+
+
+def test_plan_takes_over_unowned_maintenance():
+    # same window, but not created by a reconcile: the description is updated
+    plan = plan_reconcile(
+        [desired("a", "1")], [existing("11", maintenance_name("a", "apt"), "1")], "apt"
+    )
+    assert [p["maintenanceid"] for p in plan.update] == ["11"]
+    assert plan.update[0]["description"] == reconcile_description("apt")
+
+
+def test_plan_deletes_only_owned_maintenances():
+    plan = plan_reconcile(
+        [],
+        [
+            existing(
+                "11",
+                maintenance_name("a", "apt"),
+                "1",
+                description=reconcile_description("apt"),
+            ),
+            # same keyword, but started by hand
+            existing("12", maintenance_name("b", "apt"), "2"),
+            # "apt" is a prefix of the keyword of another state file
+            existing(
+                "13",
+                maintenance_name("c", "apt_2"),
+                "3",
+                description=reconcile_description("apt_2"),
+            ),
+            existing("14", maintenance_name("d"), "4"),
+        ],
+        "apt",
+    )
+    assert [m.maintenanceid for m in plan.delete] == ["11"]
+
+
+def test_plan_without_keyword():
+    maintenances = [
+        existing("11", maintenance_name("a", "apt"), "1"),
+        existing("12", maintenance_name("b"), "2"),
+    ]
+    plan = plan_reconcile([desired("b", "2", keyword=None)], maintenances)
+    assert plan.unchanged == [maintenance_name("b")]
+    assert "description" not in str(plan.create + plan.update)
+    assert not plan.delete
+    plan = plan_reconcile(
+        [desired("b", "2", keyword=None)], maintenances, prune_all=True
+    )
+    assert [m.maintenanceid for m in plan.delete] == ["11"]
+
+
+def test_reconcile_without_keyword_is_refused(client, fake):
+    result = reconcile(client, [desired("host1.example.com", None, keyword=None)])
+    assert result.exit_code == 1
+    assert not fake.calls
+
+
+def test_reconcile_applies_plan(client, fake):
+    hosts = ["host1.example.com", "host2.example.com"]
+    state = [
+        {
+            "kind": "host",
+            "targets": [host],
+            "name": maintenance_name(host, "apt"),
+            "since": SINCE,
+            "till": SINCE + 3600,
+            "period": 3600,
+        }
+        for host in hosts
+    ]
+    assert reconcile(client, state, "apt").exit_code == 0
+    assert {m.name for m in client.get_all_maintenances()} == {
+        maintenance_name(host, "apt") for host in hosts
+    }
+
+    # a maintenance of the same keyword which the state file does not own
+    client.create_maintenances(
+        [
+            {
+                "name": maintenance_name("host3.example.com", "apt"),
+                "since": SINCE,
+                "till": SINCE + 3600,
+                "hostids": [fake.hostids["host3.example.com"]],
+                "timeperiods": [
+                    {"timeperiod_type": 0, "start_date": SINCE, "period": 3600}
+                ],
+            }
+        ]
+    )
+    fake.reset_stats()
+    result = reconcile(client, state[:1], "apt")
+    assert result.exit_code == 0
+    assert "Plan: 0 to create, 0 to update, 1 to delete, 1 unchanged" in result.output
+    assert {m.name for m in client.get_all_maintenances()} == {
+        maintenance_name("host1.example.com", "apt"),
+        maintenance_name("host3.example.com", "apt"),
+    }
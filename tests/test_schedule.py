@@ -0,0 +1,113 @@
+"""recurring maintenances: bitmasks, timeperiods and schedule_params"""
+
+import pytest
+
+from zabbix_maintenance_lib import (
+    MONTHS,
+    WEEKDAYS,
+    Maintenance,
+    bitmask,
+    recurring_timeperiod,
+    run_action,
+    schedule_params,
+)
+
+
+def test_bitmask():
+    assert bitmask(["mon"], WEEKDAYS, "day of the week") == 1
+    assert bitmask(["Monday", "WED", "sun"], WEEKDAYS, "day of the week") == 0b1000101
+    assert bitmask(["jan", "December"], MONTHS, "month") == 0b100000000001
+    assert bitmask(MONTHS, MONTHS, "month") == 0b111111111111
+    with pytest.raises(ValueError, match='invalid month "smarch"'):
+        bitmask(["smarch"], MONTHS, "month")
+
+
+def test_weekly_timeperiod():
+    assert recurring_timeperiod("weekly", 7200, "02:30", days=["sat", "sun"]) == {
+        "timeperiod_type": 3,
+        "period": 7200,
+        "start_time": 2 * 3600 + 30 * 60,
+        "every": 1,
+        "dayofweek": 0b1100000,
+    }
+    with pytest.raises(ValueError):
+        recurring_timeperiod("weekly", 7200)
+
+
+def test_monthly_timeperiod():
+    # every month on the 1st
+    assert recurring_timeperiod("monthly", 3600, day=1, every=3) == {
+        "timeperiod_type": 4,
+        "period": 3600,
+        "start_time": 0,
+        "every": 1,
+        "month": 0b111111111111,
+        "day": 1,
+    }
+    # last friday of march and september
+    timeperiod = recurring_timeperiod(
+        "monthly", 3600, "22:00", days=["fri"], every=5, months=["mar", "sep"]
+    )
+    assert timeperiod["month"] == 0b000100000100
+    assert timeperiod["dayofweek"] == 0b0010000
+    assert timeperiod["every"] == 5
+    assert "day" not in timeperiod
+    with pytest.raises(ValueError):
+        recurring_timeperiod("monthly", 3600, day=1, days=["fri"])
+    with pytest.raises(ValueError):
+        recurring_timeperiod("monthly", 3600, days=["fri"], every=6)
+
+
+@pytest.mark.parametrize(
+    "args",
+    [("hourly", 3600), ("daily", 3600, "24:00"), ("daily", 60), ("daily", 3600, "1")],
+)
+def test_invalid_timeperiod(args):
+    with pytest.raises(ValueError):
+        recurring_timeperiod(*args)
+
+
+def test_schedule_params():
+    schedule = recurring_timeperiod("daily", 3600, "03:00")
+    created = schedule_params(None, schedule, until=2_000_000_000)
+    assert created["timeperiods"] == [schedule]
+    assert created["active_till"] == 2_000_000_000
+    # maintenance.get returns the fields as strings
+    existing = Maintenance(
+        maintenanceid="7",
+        name="maintenance_host1.example.com",
+        active_since=created["active_since"],
+        active_till=2_000_000_000,
+        timeperiods=[
+            {
+                "timeperiod_type": "2",
+                "period": "3600",
+                "start_time": "10800",
+                "every": "1",
+                "dayofweek": "0",
+                "month": "0",
+                "day": "0",
+                "start_date": "0",
+            }
+        ],
+    )
+    assert schedule_params(existing, schedule) is None
+    assert schedule_params(existing, schedule, until=2_000_000_000) is None
+    changed = schedule_params(existing, schedule, until=2_100_000_000)
+    assert changed["maintenanceid"] == "7"
+    assert changed["active_till"] == 2_100_000_000
+    other = recurring_timeperiod("daily", 3600, "04:00")
+    assert schedule_params(existing, other)["timeperiods"] == [other]
+
+
+def test_same_schedule_is_not_written(client, fake):
+    schedule = recurring_timeperiod("weekly", 3600, "01:00", days=["sun"])
+    host = "host1.example.com"
+    result = run_action(client, "start", host, "patch", schedule=schedule)
+    assert result.exit_code == 0
+    fake.reset_stats()
+    result = run_action(client, "start", host, "patch", schedule=schedule)
+    assert result.exit_code == 0
+    assert "already has the schedule" in result.output
+    methods = {c.method for c in fake.calls}
+    assert not methods & {"maintenance.create", "maintenance.update"}
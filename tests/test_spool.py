@@ -0,0 +1,108 @@
+"""merge_spooled and run_spooled"""
+
+import pytest
+from fake_zabbix import ApiError, FakeZabbix
+
+from zabbix_maintenance_lib import ZabbixClient, merge_spooled, run_spooled
+
+NOW = 1_800_000_000
+
+
+def spooled(action, submitted, keyword="apt", period=3600, host="host1.example.com"):
+    """spooled request like 'Spool.submit' stores it"""
+    return {
+        "profile": None,
+        "action": action,
+        "host": host,
+        "keyword": keyword,
+        "period": period,
+        "delete_all": False,
+        "submitted": submitted,
+    }
+
+
+def test_stop_after_start():
+    operations = merge_spooled(
+        {"a": spooled("start", NOW - 20), "b": spooled("stop", NOW - 10)}, NOW
+    )
+    assert [(o["action"], o["paths"]) for o in operations] == [("stop", ["a", "b"])]
+
+
+def test_start_after_stop():
+    operations = merge_spooled(
+        {"b": spooled("start", NOW - 10), "a": spooled("stop", NOW - 20)}, NOW
+    )
+    assert [o["action"] for o in operations] == ["stop", "start"]
+    # rounded up to whole minutes
+    assert operations[1]["period"] == 3600
+    assert operations[1]["paths"] == ["a", "b"]
+
+
+def test_starts_run_until_the_latest_end():
+    operations = merge_spooled(
+        {
+            "a": spooled("start", NOW - 600, period=7200),
+            "b": spooled("start", NOW - 10, period=600),
+            # already over
+            "c": spooled("start", NOW - 7200, keyword="old", period=3600),
+        },
+        NOW,
+    )
+    assert [(o["keyword"], o["period"]) for o in operations] == [("apt", 6600)]
+
+
+class RejectingZabbix(FakeZabbix):
+    """rejects maintenances with the keyword "bad" and drops the connection on "down" """
+
+    def api_maintenance_create(self, params):
+        if any(m["name"].endswith("_bad") for m in params):
+            raise ApiError("Maintenance is rejected.")
+        return super().api_maintenance_create(params)
+
+    def handle_raw(self, body):
+        if b"_down" in body:
+            raise ConnectionResetError("frontend went away")
+        return super().handle_raw(body)
+
+
+@pytest.fixture
+def rejecting():
+    """client of a RejectingZabbix"""
+    with RejectingZabbix(10) as server:
+        api = ZabbixClient("fake", "user", "password", url=server.url, retries=0)
+        yield api
+        api.close()
+
+
+def test_run_spooled_rejected_and_pending(rejecting):
+    operations = merge_spooled(
+        {
+            "ok": spooled("start", NOW, keyword="ok"),
+            "bad": spooled("start", NOW, keyword="bad"),
+            "down": spooled("start", NOW, keyword="down"),
+            "later": spooled("start", NOW, keyword="later"),
+        },
+        NOW,
+    )
+    result, rejected, pending = run_spooled(rejecting, operations)
+    assert result.exit_code == 1
+    assert rejected == {"bad"}
+    # not sent after the request error
+    assert pending == {"down", "later"}
+    assert [m.name for m in rejecting.get_all_maintenances()] == [
+        "maintenance_host1.example.com_ok"
+    ]
+
+
+def test_run_spooled_unreachable():
+    api = ZabbixClient(
+        "fake", "user", "password", url="http://127.0.0.1:9/api_jsonrpc.php", retries=0
+    )
+    operations = merge_spooled(
+        {"a": spooled("stop", NOW - 10), "b": spooled("start", NOW, keyword="x")}, NOW
+    )
+    result, rejected, pending = run_spooled(api, operations)
+    api.close()
+    assert result.exit_code == 1
+    assert not rejected
+    assert pending == {"a", "b"}
@@ -1,116 +1,75 @@
 #!/usr/bin/python3
 
-from datetime import datetime, timedelta
-import json
-import platform
-import socket
 import sys
-import time
-import urllib.request, urllib.error, urllib.parse
-import yaml
-import os.path
-
-if platform.system() == "Windows":
-    path = 'C:\ProgramData\zabbix\zabbix_maintenance.yml'
-else:
-    path = '/etc/zabbix/zabbix_maintenance.yml'
-if os.path.isfile(path) == True:
-    configfile = path
-else:
-    configfile = 'zabbix_maintenance.yml'
-
-with open(configfile, 'r') as ymlfile:
-    config = yaml.load(ymlfile, yaml.SafeLoader)
-
-user = config['user']
-password = config['password']
+
+from zabbix_maintenance_lib import (
+    MAINTENANCE_WINDOW_FIELDS,
+    MAX_HOURS,
+    TIMEPERIOD_FIELDS,
+    ClientError,
+    ZabbixClient,
+    default_hostname,
+    load_config,
+    maintenance_window,
+    select_profiles,
+    timeperiod_params,
+)
+
+configfile, config = load_config()
+# with several server profiles the first default profile is used
+config = next(iter(select_profiles(config).values()))
+
+# one session for the whole run, older zabbix versions expect "user" for user.login
+client = ZabbixClient.from_config(config, username_field='user')
 server = config['server']
-api = "https://" + server + "/api_jsonrpc.php"
-
-def get_token():
-    data = {'jsonrpc': '2.0', 'method': 'user.login', 'params': {'user': user, 'password': password},
-            'id': '0'}
-    req = urllib.request.Request(api)
-    data_json = json.dumps(data)
-    data_json = data_json.encode('utf-8')
-    req.add_header('content-type', 'application/json-rpc')
+
+# lookups are done only once per run
+hostids = {}
+maintenances = {}
+
+
+def call(method, params):
     try:
-        response = urllib.request.urlopen(req, data_json)
-    except urllib.error.HTTPError as ue:
+        return client.call(method, params)
+    except ClientError as ue:
         print(("Error: " + str(ue)))
         sys.exit(1)
-    else:
-        body = json.loads(response.read())
-        if not body['result']:
-            print("can't get authtoken")
-            sys.exit(1)
-        else:
-            return body['result']
 
 
 def get_host_id(check=False):
-    token = get_token()
-    data = {"jsonrpc": "2.0", "method": "host.get", "params": {"output": "extend", "filter":
-           {"host": [hostname]}}, "auth": token, "id": 0}
-    req = urllib.request.Request(api)
-    data_json = json.dumps(data)
-    data_json = data_json.encode('utf-8')
-    req.add_header('content-type', 'application/json-rpc')
-    try:
-        response = urllib.request.urlopen(req, data_json)
-    except urllib.error.HTTPError as ue:
-        print(("Error: " + str(ue)))
-    else:
-        body = json.loads(response.read())
-        if not body['result']:
-            if check:
-                return False
-            else:
-                print(("Host " + hostname + " not found on " + server))
-                sys.exit(1)
+    if hostname not in hostids:
+        result = call('host.get', {"output": ["hostid"], "filter": {"host": [hostname]}})
+        hostids[hostname] = result[0]['hostid'] if result else None
+    if hostids[hostname] is None:
+        if check:
+            return False
         else:
-            return body['result'][0]['hostid']
+            print(("Host " + hostname + " not found on " + server))
+            sys.exit(1)
+    else:
+        return hostids[hostname]
 
 
 def get_maintenance_id():
     global maintenance
     hostid = get_host_id()
-    token = get_token()
-    data = {"jsonrpc": "2.0", "method": "maintenance.get", "params": {"output": "extend", "selectGroups": "extend",
-                                                                      "selectTimeperiods": "extend", "hostids": hostid},
-            "auth": token, "id": 0}
-    req = urllib.request.Request(api)
-    data_json = json.dumps(data)
-    data_json = data_json.encode('utf-8')
-    req.add_header('content-type', 'application/json-rpc')
-    try:
-        response = urllib.request.urlopen(req, data_json)
-    except urllib.error.HTTPError as ue:
-        print(("Error: " + str(ue)))
+    if hostid not in maintenances:
+        maintenances[hostid] = call('maintenance.get', {"output": MAINTENANCE_WINDOW_FIELDS,
+                                                        "selectTimeperiods": TIMEPERIOD_FIELDS,
+                                                        "hostids": hostid})
+    result = maintenances[hostid]
+    if not result:
+        print(("No maintenance for host: " + hostname))
     else:
-        body = json.loads(response.read())
-        if not body['result']:
-            print(("No maintenance for host: " + hostname))
-        else:
-            maintenance = body['result'][0]
-            return int(body['result'][0]['maintenanceid'])
+        maintenance = result[0]
+        return int(result[0]['maintenanceid'])
 
 
 def del_maintenance(mid):
     print(("Found maintenance for host: " + hostname + " maintenance id: " + str(mid)))
-    token = get_token()
-    data = {"jsonrpc": "2.0", "method": "maintenance.delete", "params": [mid], "auth": token, "id": 1}
-    req = urllib.request.Request(api)
-    data_json = json.dumps(data)
-    data_json = data_json.encode('utf-8')
-    req.add_header('content-type', 'application/json-rpc')
-    try:
-        response = urllib.request.urlopen(req, data_json)
-    except urllib.error.HTTPError as ue:
-        print(("Error: " + str(ue)))
-        sys.exit(1)
-    else:
-        print("Removed existing maintenance")
+    call('maintenance.delete', [mid])
+    maintenances.pop(get_host_id(), None)
+    print("Removed existing maintenance")
 
 
 def start_maintenance():
@@ -125,41 +84,19 @@ def start_maintenance():
         else:
             update_maintenance(maintenance['timeperiods'],until,"Added")
     hostid = get_host_id()
-    token = get_token()
-    data = {"jsonrpc": "2.0", "method": "maintenance.create", "params":
-        {"name": "maintenance_" + hostname, "active_since": now, "active_till": until, "hostids": [hostid], "timeperiods":
-        [{"timeperiod_type": 0, "period": period}]}, "auth": token, "id": 1}
-    req = urllib.request.Request(api)
-    data_json = json.dumps(data)
-    data_json = data_json.encode('utf-8')
-    req.add_header('content-type', 'application/json-rpc')
-    try:
-        response = urllib.request.urlopen(req, data_json)
-    except urllib.error.HTTPError as ue:
-        print(("Error: " + str(ue)))
-        sys.exit(1)
-    else:
-        print("Added a %i:%02i hours maintenance on host: %s" % (period // 3600, period%3600//60, hostname ))
-        sys.exit(0)
+    call('maintenance.create', {"name": "maintenance_" + hostname, "active_since": now, "active_till": until,
+                                "hostids": [hostid], "timeperiods": [{"timeperiod_type": 0, "period": period}]})
+    print("Added a %i:%02i hours maintenance on host: %s" % (period // 3600, period%3600//60, hostname ))
+    sys.exit(0)
 
 
 def update_maintenance(mnt,act_t,task):
     hostid = get_host_id()
-    token = get_token()
-    data = {"jsonrpc": "2.0", "method": "maintenance.create", "params":
-        {"name": "maintenance_" + hostname, "active_since": int(maintenance['active_since']), "active_till": act_t, "hostids": [hostid], "timeperiods": mnt}, "auth": token, "id": 1}
-    req = urllib.request.Request(api)
-    data_json = json.dumps(data)
-    data_json = data_json.encode('utf-8')
-    req.add_header('content-type', 'application/json-rpc')
-    try:
-        response = urllib.request.urlopen(req, data_json)
-    except urllib.error.HTTPError as ue:
-        print(("Error: " + str(ue)))
-        sys.exit(1)
-    else:
-        print((task + " period on host: " + hostname))
-        sys.exit(0)
+    call('maintenance.create', {"name": "maintenance_" + hostname, "active_since": int(maintenance['active_since']),
+                                "active_till": act_t, "hostids": [hostid],
+                                "timeperiods": [timeperiod_params(tp) for tp in mnt]})
+    print((task + " period on host: " + hostname))
+    sys.exit(0)
 
 
 def stop_maintenance():
@@ -189,35 +126,35 @@ def check_host_id():
         sys.exit(1)
 
 
-if 'hostname' in config:
-    hostname = config['hostname']
-else:
-    hostname = socket.getfqdn()
+hostname = default_hostname(config)
 
 if sys.argv[3:]:
     hostname = sys.argv[3]
 
 period = 3600
 if sys.argv[2:]:
-    if float(sys.argv[2]) < 148159:
+    if float(sys.argv[2]) < MAX_HOURS:
         period = int(float(sys.argv[2]) * 3600)
     else:
         print("Error: maximum size of a period is 148159 hours")
         sys.exit(1)
-now = int(time.time())
-x = datetime.now() + timedelta(seconds=int(period))
-until = int(time.mktime(x.timetuple()))
-
-if len(sys.argv) > 1:
-    if sys.argv[1] == "start":
-        start_maintenance()
-    elif sys.argv[1] == "stop":
-        stop_maintenance()
-    elif sys.argv[1] == "check":
-        check_host_id()
+now, until = maintenance_window(period)
+
+try:
+    if len(sys.argv) > 1:
+        if sys.argv[1] == "start":
+            start_maintenance()
+        elif sys.argv[1] == "stop":
+            stop_maintenance()
+        elif sys.argv[1] == "check":
+            check_host_id()
+        else:
+            print("Error: did not receive action argument start, stop or check")
+            sys.exit(1)
     else:
-        print("Error: did not receive action argument start, stop or check")
+        print((sys.argv[0] + " <start|stop|check> [hours] [fqdn]"))
         sys.exit(1)
-else:
-    print((sys.argv[0] + " <start|stop|check> [hours] [fqdn]"))
-    sys.exit(1)
+finally:
+    # also on sys.exit, to not leave open sessions on the server
+    client.logout()
+    client.close()
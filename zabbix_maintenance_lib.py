@@ -0,0 +1,2634 @@
+"""Zabbix maintenance client library
+
+Shared by zabbix_maintenance.py and zabbix_maintenance_v7.py and importable without side effects,
+so orchestrators can drive many hosts in-process over one API session:
+
+    from zabbix_maintenance_lib import ZabbixClient, load_config, start
+
+    with ZabbixClient.from_config(load_config()[1]) as client:
+        result = start(client, "host.example.com", keyword="patch", period=7200)
+        print(result.output)
+"""
+
+import concurrent.futures
+import fnmatch
+import functools
+import hashlib
+import json
+import logging
+import os
+import platform
+import random
+import socket
+import threading
+import time
+from dataclasses import asdict, dataclass, field
+from datetime import datetime, timedelta
+
+# requests, yaml, sqlite3 and asyncio are imported where they are needed,
+# to keep the startup of the scripts (and the broker client) fast
+
+log = logging.getLogger(__name__)
+
+# zabbix does not accept longer periods
+MAX_HOURS = 148159
+
+# API methods without side effects, which are retried (and hedged) on request errors
+IDEMPOTENT_METHODS = {
+    "apiinfo.version",
+    "user.login",
+    "host.get",
+    "hostgroup.get",
+    "template.get",
+    "maintenance.get",
+}
+# API methods which change maintenances (and invalidate the check cache)
+MAINTENANCE_WRITE_METHODS = {
+    "maintenance.create",
+    "maintenance.update",
+    "maintenance.delete",
+}
+# HTTP status codes of an overloaded or restarting frontend
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# fields requested by the actions, "extend" (everything) is only requested with 'verbose'
+MAINTENANCE_FIELDS = ["maintenanceid", "name"]
+MAINTENANCE_WINDOW_FIELDS = MAINTENANCE_FIELDS + ["active_since", "active_till"]
+TIMEPERIOD_FIELDS = [
+    "timeperiod_type",
+    "period",
+    "start_date",
+    "start_time",
+    "every",
+    "dayofweek",
+    "day",
+    "month",
+]
+# recurring timeperiods of zabbix
+SCHEDULE_TYPES = {"daily": 2, "weekly": 3, "monthly": 4}
+WEEKDAYS = ["mon", "tue", "wed", "thu", "fri", "sat", "sun"]
+MONTHS = [
+    "jan",
+    "feb",
+    "mar",
+    "apr",
+    "may",
+    "jun",
+    "jul",
+    "aug",
+    "sep",
+    "oct",
+    "nov",
+    "dec",
+]
+# default lifetime of a recurring maintenance
+SCHEDULE_DAYS = 365
+# config keys which are not written to the config cache (see 'load_config')
+SECRET_KEYS = ("password", "api_token")
+# maintenances per maintenance.get when all maintenances are listed
+# and per maintenance.delete
+PAGE_SIZE = 500
+
+
+# --- errors and records ---
+
+
+class ClientError(Exception):
+    """base of all errors of an API call"""
+
+
+class RequestError(ClientError):
+    """HTTP or connection error of an API call, 'error' is the original requests exception"""
+
+    def __init__(self, error):
+        super().__init__(str(error))
+        self.error = error
+
+
+class ZabbixError(ClientError):
+    """error returned by the zabbix API"""
+
+    def __init__(self, code, message, data):
+        super().__init__(f"Zabbix API Error {code}: {message}")
+        self.code = code
+        self.message = message
+        self.data = data
+
+
+@dataclass
+class Maintenance:
+    """maintenance object as returned by maintenance.get"""
+
+    maintenanceid: str
+    name: str
+    active_since: int = 0
+    active_till: int = 0
+    timeperiods: list = field(default_factory=list)
+    hostids: list = field(default_factory=list)
+    groupids: list = field(default_factory=list)
+    description: str = ""
+    # the complete maintenance.get object, shown with 'verbose'
+    data: dict = field(default_factory=dict, repr=False)
+
+    @classmethod
+    def from_api(cls, data):
+        """create from a maintenance.get result"""
+        return cls(
+            maintenanceid=data["maintenanceid"],
+            name=data["name"],
+            active_since=int(data.get("active_since", 0)),
+            active_till=int(data.get("active_till", 0)),
+            timeperiods=data.get("timeperiods", []),
+            hostids=[h["hostid"] for h in data.get("hosts", [])],
+            groupids=[g["groupid"] for g in data.get("groups", [])],
+            description=data.get("description", ""),
+            data=data,
+        )
+
+    def covers(self, since, till):
+        """check if there is a one time period which already covers since..till"""
+        if self.active_since > since or self.active_till < till:
+            return False
+        for tp in self.timeperiods:
+            if int(tp["timeperiod_type"]) != 0:
+                continue
+            start_date = int(tp.get("start_date", self.active_since))
+            if start_date <= since and start_date + int(tp["period"]) >= till:
+                return True
+        return False
+
+    def extend_params(self, since, till, period):
+        """return the maintenance.update params to add a one time period starting at 'since',
+        expired one time periods are dropped and the later 'active_till' is kept"""
+        timeperiods = [
+            timeperiod_params(tp)
+            for tp in self.timeperiods
+            if int(tp["timeperiod_type"]) != 0
+            or int(tp.get("start_date", self.active_since)) + int(tp["period"]) > since
+        ]
+        timeperiods.append(
+            {"timeperiod_type": 0, "start_date": since, "period": period}
+        )
+        return {
+            "maintenanceid": self.maintenanceid,
+            "active_since": min(self.active_since, since),
+            "active_till": max(self.active_till, till),
+            "timeperiods": timeperiods,
+        }
+
+
+@dataclass
+class ReconcilePlan:
+    """changes to reach a desired state: maintenance.create and maintenance.update params,
+    Maintenance objects to delete and names of the unchanged maintenances"""
+
+    create: list = field(default_factory=list)
+    update: list = field(default_factory=list)
+    delete: list = field(default_factory=list)
+    unchanged: list = field(default_factory=list)
+
+    @property
+    def api_calls(self):
+        """number of bulk API calls to apply the plan"""
+        return bool(self.create) + bool(self.update) + -(-len(self.delete) // PAGE_SIZE)
+
+
+@dataclass
+class ActionResult:
+    """outcome of a start/stop/check action, 'lines' is the output for the user"""
+
+    host: str
+    exit_code: int = 0
+    lines: list = field(default_factory=list)
+
+    def add(self, line):
+        """add an output line"""
+        self.lines.append(line)
+
+    def fail(self, exit_code, line):
+        """add an output line and set the exit code, returns the result"""
+        self.lines.append(line)
+        self.exit_code = max(self.exit_code, exit_code)
+        return self
+
+    @property
+    def output(self):
+        """output lines as one string"""
+        return "".join(f"{line}\n" for line in self.lines)
+
+
+# --- instrumentation ---
+
+
+@dataclass
+class CallRecord:
+    """timing of one API request, 'outcome' is "ok", "api_error", "session_terminated"
+    or the name of the request exception, 'retries' is the number of preceding attempts
+    and 'hedged' marks a duplicate request"""
+
+    server: str
+    method: str
+    started: float
+    seconds: float
+    request_bytes: int = 0
+    response_bytes: int = 0
+    retries: int = 0
+    outcome: str = "ok"
+    hedged: bool = False
+
+
+class CallTimings:
+    """collects the CallRecords of one or more clients (thread safe),
+    with 'trace_file' each record is also appended as a JSON line"""
+
+    def __init__(self, trace_file=None):
+        self.records = []
+        self.lock = threading.Lock()
+        self.trace = None
+        if trace_file:
+            # pylint: disable=consider-using-with
+            self.trace = open(trace_file, "a", encoding="utf-8")
+
+    def record(self, call_record):
+        """add a record and write it to the trace file"""
+        with self.lock:
+            self.records.append(call_record)
+            if self.trace is not None:
+                self.trace.write(json.dumps(call_record.__dict__) + "\n")
+                self.trace.flush()
+
+    def close(self):
+        """close the trace file"""
+        if self.trace is not None:
+            self.trace.close()
+            self.trace = None
+
+    def by_method(self):
+        """return dict (server, method): [CallRecord]"""
+        with self.lock:
+            records = list(self.records)
+        grouped = {}
+        for call_record in records:
+            grouped.setdefault((call_record.server, call_record.method), []).append(
+                call_record
+            )
+        return grouped
+
+    def summary_lines(self):
+        """output lines with calls, errors, retries, latency and bytes per server and method"""
+        lines = [
+            f"{'server':<20} {'method':<20} {'calls':>5} {'errors':>6} {'retries':>7} "
+            f"{'total ms':>9} {'max ms':>8} {'sent':>9} {'received':>9}"
+        ]
+        total = 0.0
+        for (server, method), records in sorted(self.by_method().items()):
+            seconds = [r.seconds for r in records]
+            total += sum(seconds)
+            lines.append(
+                f"{server:<20} {method:<20} {len(records):>5} "
+                f"{sum(r.outcome != 'ok' for r in records):>6} "
+                f"{sum(r.retries > 0 for r in records):>7} "
+                f"{sum(seconds) * 1000:>9.1f} {max(seconds) * 1000:>8.1f} "
+                f"{sum(r.request_bytes for r in records):>9} "
+                f"{sum(r.response_bytes for r in records):>9}"
+            )
+        lines.append(f"{len(self.records)} API call(s), {total * 1000:.1f} ms in total")
+        return lines
+
+    def write_textfile(self, path, labels=None, run_seconds=None, exit_code=None):
+        """write the metrics in the Prometheus text format for the textfile collector
+        of node_exporter, the file is replaced atomically"""
+        base = {key: str(value) for key, value in (labels or {}).items()}
+
+        def metric(name, value, **extra):
+            label_text = ",".join(
+                f'{key}="{escape_label(value)}"'
+                for key, value in {**base, **extra}.items()
+            )
+            return (
+                f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}"
+            )
+
+        lines = [
+            "# HELP zabbix_maintenance_api_calls_total API calls by method and outcome.",
+            "# TYPE zabbix_maintenance_api_calls_total counter",
+        ]
+        grouped = self.by_method()
+        for (server, method), records in sorted(grouped.items()):
+            outcomes = {}
+            for call_record in records:
+                outcomes[call_record.outcome] = outcomes.get(call_record.outcome, 0) + 1
+            for outcome, count in sorted(outcomes.items()):
+                lines.append(
+                    metric(
+                        "zabbix_maintenance_api_calls_total",
+                        count,
+                        server=server,
+                        method=method,
+                        outcome=outcome,
+                    )
+                )
+        for name, kind, help_text, value in (
+            (
+                "zabbix_maintenance_api_call_duration_seconds",
+                "summary",
+                "Latency of the API calls.",
+                None,
+            ),
+            (
+                "zabbix_maintenance_api_retries_total",
+                "counter",
+                "Retries of the API calls.",
+                lambda records: sum(r.retries > 0 for r in records),
+            ),
+            (
+                "zabbix_maintenance_api_hedged_total",
+                "counter",
+                "Hedged duplicate requests of the API calls.",
+                lambda records: sum(r.hedged for r in records),
+            ),
+            (
+                "zabbix_maintenance_api_request_bytes_total",
+                "counter",
+                "Bytes sent to the API.",
+                lambda records: sum(r.request_bytes for r in records),
+            ),
+            (
+                "zabbix_maintenance_api_response_bytes_total",
+                "counter",
+                "Bytes received from the API.",
+                lambda records: sum(r.response_bytes for r in records),
+            ),
+        ):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for (server, method), records in sorted(grouped.items()):
+                if value is None:
+                    lines.append(
+                        metric(
+                            f"{name}_sum",
+                            round(sum(r.seconds for r in records), 6),
+                            server=server,
+                            method=method,
+                        )
+                    )
+                    lines.append(
+                        metric(
+                            f"{name}_count", len(records), server=server, method=method
+                        )
+                    )
+                else:
+                    lines.append(
+                        metric(name, value(records), server=server, method=method)
+                    )
+        if run_seconds is not None:
+            lines.append(
+                "# HELP zabbix_maintenance_run_duration_seconds Wall time of the last run."
+            )
+            lines.append("# TYPE zabbix_maintenance_run_duration_seconds gauge")
+            lines.append(
+                metric("zabbix_maintenance_run_duration_seconds", round(run_seconds, 6))
+            )
+        if exit_code is not None:
+            lines.append(
+                "# HELP zabbix_maintenance_run_exit_code Exit code of the last run."
+            )
+            lines.append("# TYPE zabbix_maintenance_run_exit_code gauge")
+            lines.append(metric("zabbix_maintenance_run_exit_code", exit_code))
+        lines.append(
+            "# HELP zabbix_maintenance_last_run_timestamp_seconds End of the last run."
+        )
+        lines.append("# TYPE zabbix_maintenance_last_run_timestamp_seconds gauge")
+        lines.append(
+            metric("zabbix_maintenance_last_run_timestamp_seconds", int(time.time()))
+        )
+        with open(f"{path}.tmp", "w", encoding="utf-8") as textfile:
+            textfile.write("\n".join(lines) + "\n")
+        os.replace(f"{path}.tmp", path)
+
+
+def escape_label(value):
+    """escape a Prometheus label value"""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+# --- helpers ---
+
+
+def timeperiod_params(timeperiod):
+    """return the writable fields of a timeperiod from maintenance.get"""
+    match int(timeperiod["timeperiod_type"]):
+        case 0:
+            fields = ["start_date"]
+        case 2:
+            fields = ["start_time", "every"]
+        case 3:
+            fields = ["start_time", "every", "dayofweek"]
+        case _:
+            fields = ["start_time", "month", "day", "dayofweek", "every"]
+    params = {
+        "timeperiod_type": int(timeperiod["timeperiod_type"]),
+        "period": int(timeperiod["period"]),
+    }
+    for name in fields:
+        if name not in timeperiod:
+            continue
+        # "day" and "dayofweek" of monthly periods exclude each other
+        if name in ("day", "dayofweek") and int(timeperiod[name]) == 0:
+            continue
+        params[name] = int(timeperiod[name])
+    return params
+
+
+def maintenance_name(host, keyword=None):
+    """set maintenance object name
+    if keyword was provided, use it as suffix in object name"""
+    if keyword:
+        return f"maintenance_{host}_{keyword}"
+    return f"maintenance_{host}"
+
+
+def scope_maintenance_name(kind, names, keyword=None):
+    """maintenance object name for host groups or templates ('kind' "group" or "template")"""
+    return maintenance_name(f"{kind}_{'+'.join(sorted(names))}", keyword)
+
+
+def maintenance_record(server, data, verbose=False):
+    """one record of the listing of all maintenances from a maintenance.get object,
+    with 'verbose' the complete object"""
+    if verbose:
+        return {"server": server, **data}
+    return {
+        "server": server,
+        "maintenanceid": data["maintenanceid"],
+        "name": data["name"],
+        "active_since": int(data.get("active_since", 0)),
+        "active_till": int(data.get("active_till", 0)),
+        "hosts": [h["host"] for h in data.get("hosts", [])],
+        "groups": [g["name"] for g in data.get("groups", [])],
+        "timeperiods": [timeperiod_params(tp) for tp in data.get("timeperiods", [])],
+    }
+
+
+def maintenance_matches(name, host, keyword=None):
+    """match a maintenance name like the zabbix search of 'ZabbixClient.get_maintenances':
+    case insensitive, prefix match without keyword and exact match (with "*" as wildcard) with keyword
+    """
+    name = name.lower()
+    pattern = maintenance_name(host, keyword).lower()
+    if keyword is None:
+        return name.startswith(pattern)
+    return fnmatch.fnmatchcase(name, pattern)
+
+
+def format_period(period):
+    """format seconds as hours:minutes"""
+    return f"{period//3600}:{period%3600//60:02n}"
+
+
+def bitmask(names, all_names, kind):
+    """zabbix bitmask of weekdays or months (first three letters, case insensitive)"""
+    mask = 0
+    for name in names:
+        try:
+            mask |= 1 << all_names.index(str(name).strip().lower()[:3])
+        except ValueError:
+            raise ValueError(
+                f'invalid {kind} "{name}" (use {", ".join(all_names)})'
+            ) from None
+    return mask
+
+
+def recurring_timeperiod(
+    schedule, period, at="00:00", days=None, day=None, every=1, months=None
+):
+    """timeperiod of a recurring maintenance of 'period' seconds starting at 'at' ("HH:MM"):
+    "daily" every 'every' days, "weekly" on 'days' every 'every' weeks or "monthly" in
+    'months' (default all) on 'day' of the month or on 'days' of the 'every'th week
+    (5 is the last week), raises ValueError"""
+    if schedule not in SCHEDULE_TYPES:
+        raise ValueError(f'invalid schedule "{schedule}" (use daily, weekly, monthly)')
+    hours, sep, minutes = str(at).partition(":")
+    if not (sep and hours.isdigit() and minutes.isdigit()) or not (
+        int(hours) < 24 and int(minutes) < 60
+    ):
+        raise ValueError(f'invalid start time "{at}" (use HH:MM)')
+    if period < 300:
+        raise ValueError("a recurring maintenance needs at least 5 minutes")
+    if every < 1:
+        raise ValueError('"every" must be at least 1')
+    timeperiod = {
+        "timeperiod_type": SCHEDULE_TYPES[schedule],
+        "period": period,
+        "start_time": int(hours) * 3600 + int(minutes) * 60,
+        "every": every,
+    }
+    match schedule:
+        case "weekly":
+            if not days:
+                raise ValueError("a weekly schedule needs days of the week")
+            timeperiod["dayofweek"] = bitmask(days, WEEKDAYS, "day of the week")
+        case "monthly":
+            timeperiod["month"] = bitmask(months or MONTHS, MONTHS, "month")
+            if (day is None) == (not days):
+                raise ValueError(
+                    "a monthly schedule needs either a day of the month or days of the week"
+                )
+            if day is not None:
+                if not 1 <= day <= 31:
+                    raise ValueError("the day of the month must be 1 to 31")
+                timeperiod["day"] = day
+                timeperiod["every"] = 1
+            else:
+                if every > 5:
+                    raise ValueError(
+                        'the week of the month ("every") must be 1 to 4 or 5 for the last week'
+                    )
+                timeperiod["dayofweek"] = bitmask(days, WEEKDAYS, "day of the week")
+    return timeperiod
+
+
+def schedule_params(existing, schedule, until=None):
+    """maintenance.create ('existing' is None) or maintenance.update params of a recurring
+    maintenance with only the timeperiod 'schedule' until 'until' (default the current end or
+    SCHEDULE_DAYS from now), None if 'existing' already has this schedule"""
+    now = int(time.time())
+    default_till = now + SCHEDULE_DAYS * 86400
+    if existing is None:
+        return {
+            "active_since": now,
+            "active_till": until or default_till,
+            "timeperiods": [schedule],
+        }
+    if [timeperiod_params(tp) for tp in existing.timeperiods] == [schedule] and (
+        until is None or until == existing.active_till
+    ):
+        return None
+    return {
+        "maintenanceid": existing.maintenanceid,
+        "active_since": min(existing.active_since, now),
+        "active_till": until or max(existing.active_till, default_till),
+        "timeperiods": [schedule],
+    }
+
+
+def format_schedule(timeperiod):
+    """short description of a recurring timeperiod"""
+    start = timeperiod["start_time"]
+    text = (
+        f"{format_period(timeperiod['period'])} hour "
+        f"{next(k for k, v in SCHEDULE_TYPES.items() if v == timeperiod['timeperiod_type'])}"
+    )
+    return f"{text} maintenance at {start // 3600:02}:{start % 3600 // 60:02}"
+
+
+def format_time(timestamp):
+    """local time of a timestamp for the output"""
+    return datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d %H:%M")
+
+
+def maintenance_window(period):
+    """return (since, till) of a maintenance starting now"""
+    since = int(time.time())
+    till = int(time.mktime((datetime.now() + timedelta(seconds=period)).timetuple()))
+    return since, till
+
+
+def hours_to_period(hours):
+    """convert hours to seconds, raises ValueError above the zabbix maximum"""
+    if hours >= MAX_HOURS:
+        raise ValueError(f"maximum size of a period is {MAX_HOURS} hours")
+    return int(hours * 3600)
+
+
+# --- config ---
+
+
+def cache_dir():
+    """directory for local caches, the environment variable "ZABBIX_MAINTENANCE_CACHE"
+    overrides it, an empty value disables these caches"""
+    path = os.environ.get("ZABBIX_MAINTENANCE_CACHE")
+    if path is None:
+        if platform.system() == "Windows":
+            base = os.environ.get("LOCALAPPDATA", os.path.expanduser("~"))
+        else:
+            base = os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache"))
+        path = os.path.join(base, "zabbix_maintenance")
+    return path or None
+
+
+def read_cache(name):
+    """return the content of a JSON cache file or None"""
+    directory = cache_dir()
+    if directory is None:
+        return None
+    try:
+        with open(os.path.join(directory, name), "r", encoding="utf-8") as cachefile:
+            return json.load(cachefile)
+    except (OSError, ValueError):
+        return None
+
+
+def write_cache(name, data):
+    """write a JSON cache file readable only for the current user"""
+    directory = cache_dir()
+    if directory is None:
+        return
+    path = os.path.join(directory, name)
+    try:
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        # concurrent runs write the same cache files
+        tmp_path = f"{path}.{os.getpid()}-{threading.get_ident()}.tmp"
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w", encoding="utf-8") as cachefile:
+            json.dump(data, cachefile)
+        os.replace(tmp_path, path)
+    except (OSError, TypeError, ValueError) as err:
+        log.debug('Could not write cache "%s": %s', path, err)
+
+
+def default_config_path():
+    """default path of the config file"""
+    if platform.system() == "Windows":
+        return r"C:\ProgramData\zabbix\zabbix_maintenance.yml"
+    return "/etc/zabbix/zabbix_maintenance.yml"
+
+
+class ConfigSecret:
+    """password or API token of the config file, the config cache does not contain them,
+    so they are read from the YAML file only when they are used (see 'reveal')"""
+
+    def __init__(self, config_file, keys):
+        self.config_file = config_file
+        self.keys = keys
+
+    def __repr__(self):
+        return f"ConfigSecret({self.config_file!r}, {self.keys!r})"
+
+    def reveal(self):
+        """the value from the config file, None if it is not there (anymore)"""
+        value = parse_config(self.config_file, os.stat(self.config_file).st_mtime_ns)
+        for key in self.keys:
+            if not isinstance(value, dict):
+                return None
+            value = value.get(key)
+        return value
+
+
+def reveal(value):
+    """the value of a ConfigSecret, other values as they are"""
+    return value.reveal() if isinstance(value, ConfigSecret) else value
+
+
+@functools.lru_cache(maxsize=4)
+def parse_config(config_file, mtime_ns):  # pylint: disable=unused-argument
+    """parse the YAML config, once per file and modification time"""
+    import yaml  # pylint: disable=import-outside-toplevel
+
+    with open(config_file, "r", encoding="utf-8") as ymlfile:
+        return yaml.load(ymlfile, Loader=yaml.SafeLoader)
+
+
+def secret_paths(config):
+    """key paths of the secrets of a config: top level and server profiles"""
+    paths = [[key] for key in SECRET_KEYS if key in config]
+    for name, profile in (config.get("servers") or {}).items():
+        if isinstance(profile, dict):
+            paths += [["servers", name, key] for key in SECRET_KEYS if key in profile]
+    return paths
+
+
+def without_secrets(config):
+    """copy of a config dict without the SECRET_KEYS"""
+    return {key: value for key, value in config.items() if key not in SECRET_KEYS}
+
+
+def load_config(path=None):
+    """load the YAML config, falls back to "zabbix_maintenance.yml" in the current directory,
+    returns (config file, config), raises FileNotFoundError
+
+    The parsed config is cached until the modification time or size of the file changes,
+    so most runs do not need to import and run the YAML parser. Passwords and API tokens are
+    not cached, they are ConfigSecret objects in a config from the cache."""
+    config_file = path or default_config_path()
+    if not os.path.isfile(config_file):
+        config_file = "zabbix_maintenance.yml"
+    stat = os.stat(config_file)
+    cache_name = (
+        "config-"
+        + hashlib.sha1(os.path.abspath(config_file).encode("utf-8")).hexdigest()[:16]
+        + ".json"
+    )
+    cached = read_cache(cache_name)
+    if (
+        cached is not None
+        and cached.get("mtime_ns") == stat.st_mtime_ns
+        and cached.get("size") == stat.st_size
+        # older caches contain the secrets, they are overwritten
+        and "secrets" in cached
+    ):
+        config = cached["config"]
+        for keys in cached["secrets"]:
+            parent = config
+            for key in keys[:-1]:
+                parent = parent[key]
+            parent[keys[-1]] = ConfigSecret(config_file, keys)
+        return config_file, config
+
+    config = parse_config(config_file, stat.st_mtime_ns)
+    public, secrets = config, []
+    if isinstance(config, dict):
+        secrets = secret_paths(config)
+        public = without_secrets(config)
+        if isinstance(config.get("servers"), dict):
+            public["servers"] = {
+                name: without_secrets(profile) if isinstance(profile, dict) else profile
+                for name, profile in config["servers"].items()
+            }
+    write_cache(
+        cache_name,
+        {
+            "mtime_ns": stat.st_mtime_ns,
+            "size": stat.st_size,
+            "config": public,
+            "secrets": secrets,
+        },
+    )
+    return config_file, config
+
+
+def default_hostname(config):
+    """hostname from config or the (cached) fqdn of this host"""
+    if "hostname" in config:
+        return config["hostname"]
+    return cached_fqdn(
+        float(config.get("fqdn_timeout", 2)), int(config.get("fqdn_cache_ttl", 86400))
+    )
+
+
+def server_profiles(config):
+    """named server profiles of the config, a config without "servers" is one profile
+    named after its server
+
+    Each profile in "servers" inherits the top level keys. Cache files inherited from the
+    top level ("token_cache", "host_index") get the profile name appended, so the servers
+    do not overwrite each other's sessions or host ids."""
+    servers = config.get("servers")
+    if not servers:
+        return {str(config.get("server", "default")): config}
+    base = {
+        key: value
+        for key, value in config.items()
+        if key not in ("servers", "default_servers")
+    }
+    profiles = {}
+    for name, profile in servers.items():
+        profile = dict(profile or {})
+        for key in ("token_cache", "host_index"):
+            if key not in profile and base.get(key):
+                profile[key] = f"{base[key]}.{name}"
+        profiles[str(name)] = {**base, **profile}
+    return profiles
+
+
+def select_profiles(config, names=None):
+    """server profiles to use, 'names' (or "default_servers" of the config) selects them,
+    "all" selects every profile, raises ValueError for an unknown profile"""
+    profiles = server_profiles(config)
+    names = names or config.get("default_servers")
+    if isinstance(names, str):
+        names = [names]
+    if not names or "all" in names:
+        return profiles
+    unknown = [name for name in names if name not in profiles]
+    if unknown:
+        raise ValueError(
+            f"Unknown server profile(s): {', '.join(unknown)} "
+            f"(available: {', '.join(profiles)})"
+        )
+    return {name: profiles[name] for name in names}
+
+
+def cached_fqdn(timeout=2, ttl=86400):
+    """fqdn of this host, cached for 'ttl' seconds
+
+    The reverse DNS lookup of socket.getfqdn() can hang for a long time, after 'timeout' seconds
+    the short hostname is used instead (and not cached)."""
+    cached = read_cache("fqdn.json")
+    if cached is not None and cached.get("expires", 0) > time.time():
+        return cached["fqdn"]
+    fqdn = []
+    lookup = threading.Thread(target=lambda: fqdn.append(socket.getfqdn()), daemon=True)
+    lookup.start()
+    lookup.join(timeout)
+    if not fqdn:
+        log.warning(
+            "FQDN lookup timed out after %s seconds, using the hostname", timeout
+        )
+        return socket.gethostname()
+    write_cache("fqdn.json", {"fqdn": fqdn[0], "expires": int(time.time()) + ttl})
+    return fqdn[0]
+
+
+# --- host index ---
+
+
+class HostIndex:
+    """local sqlite index of hostname -> hostid"""
+
+    def __init__(self, path, ttl=86400):
+        import sqlite3  # pylint: disable=import-outside-toplevel
+
+        self.path = path
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS hosts "
+            "(host TEXT PRIMARY KEY, hostid TEXT NOT NULL, updated INTEGER NOT NULL)"
+        )
+
+    def lookup(self, hosts):
+        """return dict host: hostid of all hosts with a fresh entry"""
+        found = {}
+        min_updated = int(time.time()) - self.ttl
+        with self.lock:
+            # stay below the sqlite limit of host parameters
+            for i in range(0, len(hosts), 500):
+                chunk = hosts[i : i + 500]
+                rows = self.conn.execute(
+                    f"SELECT host, hostid FROM hosts WHERE updated >= ? "
+                    f"AND host IN ({','.join('?' * len(chunk))})",
+                    [min_updated, *chunk],
+                )
+                found.update(dict(rows))
+        return found
+
+    def store(self, hostids, replace_all=False):
+        """write dict host: hostid"""
+        updated = int(time.time())
+        with self.lock, self.conn:
+            if replace_all:
+                self.conn.execute("DELETE FROM hosts")
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO hosts (host, hostid, updated) VALUES (?, ?, ?)",
+                [(host, hostid, updated) for host, hostid in hostids.items()],
+            )
+
+    def forget(self, hosts):
+        """remove hosts"""
+        if not hosts:
+            return
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "DELETE FROM hosts WHERE host = ?", [(host,) for host in hosts]
+            )
+
+    def close(self):
+        """close the database"""
+        self.conn.close()
+
+
+class CheckCache:
+    """local cache of the maintenances found by 'check' per server, host and keyword,
+    an entry expires after 'ttl' seconds or when one of its maintenances ends"""
+
+    def __init__(self, server, ttl):
+        self.prefix = f"check-{hashlib.sha1(server.encode('utf-8')).hexdigest()[:12]}-"
+        self.ttl = ttl
+
+    def cache_name(self, host, keyword):
+        """cache file of a host and keyword"""
+        key = json.dumps([host, keyword]).encode("utf-8")
+        return f"{self.prefix}{hashlib.sha1(key).hexdigest()[:16]}.json"
+
+    def get(self, host, keyword=None):
+        """return (hostid, [Maintenance]) of a fresh entry or None"""
+        entry = read_cache(self.cache_name(host, keyword))
+        if (
+            entry is None
+            or entry.get("host") != host
+            or entry.get("keyword") != keyword
+            or entry.get("expires", 0) <= time.time()
+        ):
+            return None
+        return entry["hostid"], [Maintenance(**m) for m in entry["maintenances"]]
+
+    def put(self, host, keyword, hostid, maintenances):
+        """store the maintenances found for a host and keyword"""
+        now = int(time.time())
+        expires = min(
+            [now + self.ttl]
+            + [m.active_till for m in maintenances if m.active_till > now]
+        )
+        write_cache(
+            self.cache_name(host, keyword),
+            {
+                "host": host,
+                "keyword": keyword,
+                "hostid": hostid,
+                "expires": expires,
+                "maintenances": [asdict(m) for m in maintenances],
+            },
+        )
+
+    def clear(self):
+        """remove all entries of the server"""
+        directory = cache_dir()
+        if directory is None:
+            return
+        try:
+            entries = list(os.scandir(directory))
+        except OSError:
+            return
+        for entry in entries:
+            if entry.name.startswith(self.prefix):
+                try:
+                    os.remove(entry.path)
+                except OSError:
+                    pass
+
+
+class Spool:
+    """durable local queue of start/stop requests, one JSON file per request
+
+    A request is written to a temporary file, synced and renamed, so it is either complete or
+    not there. Flushers claim requests by renaming their files, so every request is sent by one
+    flusher only, claims of a crashed flusher are taken over after 'stale_after' seconds.
+    Only one flusher at a time retries until the spool is empty (see 'lock').
+    """
+
+    def __init__(self, path, stale_after=600):
+        self.path = path
+        self.failed_path = os.path.join(path, "failed")
+        self.stale_after = stale_after
+        os.makedirs(path, mode=0o700, exist_ok=True)
+
+    def submit(self, request):
+        """queue a request (dict), returns the path of its file"""
+        name = f"{time.time_ns():020d}-{os.getpid()}-{random.getrandbits(32):08x}.json"
+        path = os.path.join(self.path, name)
+        fd = os.open(f"{path}.tmp", os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, "w", encoding="utf-8") as spoolfile:
+            json.dump(request, spoolfile)
+            spoolfile.flush()
+            os.fsync(spoolfile.fileno())
+        os.replace(f"{path}.tmp", path)
+        return path
+
+    def claim(self):
+        """claim all queued requests, returns dict path: request in submission order,
+        unreadable requests are moved to "failed" """
+        claimed = {}
+        suffix = f".claimed-{os.getpid()}-{random.getrandbits(32):08x}"
+        now = time.time()
+        for entry in sorted(os.scandir(self.path), key=lambda e: e.name):
+            name, sep, _ = entry.name.partition(".claimed-")
+            if not name.endswith(".json") or not entry.is_file():
+                continue
+            try:
+                if sep and now - entry.stat().st_mtime < self.stale_after:
+                    continue
+                path = os.path.join(self.path, name + suffix)
+                os.rename(entry.path, path)
+            except OSError:
+                # claimed by another flusher in the meantime
+                continue
+            # the claim time tells other flushers when the claim becomes stale
+            os.utime(path)
+            try:
+                with open(path, "r", encoding="utf-8") as spoolfile:
+                    claimed[path] = json.load(spoolfile)
+            except (OSError, ValueError) as err:
+                log.warning('Unreadable spooled request "%s": %s', path, err)
+                self.reject([path])
+        return claimed
+
+    def release(self, paths):
+        """put claimed requests back into the queue"""
+        for path in paths:
+            os.replace(path, path.partition(".claimed-")[0])
+
+    def remove(self, paths):
+        """remove claimed requests which are done"""
+        for path in paths:
+            os.remove(path)
+
+    def reject(self, paths):
+        """move claimed requests which can not be sent to "failed" """
+        os.makedirs(self.failed_path, mode=0o700, exist_ok=True)
+        for path in paths:
+            name = os.path.basename(path).partition(".claimed-")[0]
+            os.replace(path, os.path.join(self.failed_path, name))
+
+    def queued(self):
+        """check if there are queued (not claimed) requests"""
+        return any(
+            entry.name.endswith(".json") and entry.is_file()
+            for entry in os.scandir(self.path)
+        )
+
+    def lock(self):
+        """become the one retrying flusher of the spool, returns False if another one runs,
+        the lock is taken over if it was not refreshed for 'stale_after' seconds"""
+        path = os.path.join(self.path, "flusher.lock")
+        for _ in range(2):
+            try:
+                os.close(os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600))
+                return True
+            except FileExistsError:
+                try:
+                    if time.time() - os.stat(path).st_mtime < self.stale_after:
+                        return False
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+        return False
+
+    def refresh_lock(self):
+        """show other flushers that the lock is still held"""
+        os.utime(os.path.join(self.path, "flusher.lock"))
+
+    def unlock(self):
+        """release the lock of 'lock'"""
+        try:
+            os.remove(os.path.join(self.path, "flusher.lock"))
+        except FileNotFoundError:
+            pass
+
+
+# --- flow control ---
+
+
+class AdaptiveLimiter:
+    """client side flow control of the API requests of a client (thread safe)
+
+    At most 'limit' requests are sent at the same time. The limit is adapted with AIMD:
+    it grows by one per round of requests answered within 'target_latency' seconds (up to
+    'max_concurrency') and is halved (down to 'min_concurrency') after a slower request or
+    one failed by a timeout, connection error or overload response, at most once per
+    'target_latency'. With 'max_rps' the requests are spaced to at most that many per second.
+    """
+
+    def __init__(
+        self, max_concurrency, max_rps=None, target_latency=2.0, min_concurrency=1
+    ):
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min(min_concurrency, max_concurrency)
+        self.limit = float(max_concurrency)
+        self.max_rps = max_rps
+        self.target_latency = target_latency
+        self.in_flight = 0
+        self.next_send = 0.0
+        self.last_decrease = 0.0
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        """wait until a request may be sent"""
+        delay = 0.0
+        with self.condition:
+            self.condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+            if self.max_rps:
+                now = time.monotonic()
+                send = max(now, self.next_send)
+                self.next_send = send + 1 / self.max_rps
+                delay = send - now
+        if delay > 0:
+            time.sleep(delay)
+
+    def release(self, seconds, overloaded=False):
+        """a request finished after 'seconds', adapt the limit"""
+        with self.condition:
+            self.in_flight -= 1
+            now = time.monotonic()
+            if overloaded or seconds > self.target_latency:
+                # the requests in flight see the same overload, decrease only once for them
+                if now - self.last_decrease > self.target_latency:
+                    self.limit = max(self.min_concurrency, self.limit / 2)
+                    self.last_decrease = now
+                    log.debug("Concurrency limit decreased to %d", int(self.limit))
+            else:
+                self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+            self.condition.notify_all()
+
+
+# --- client ---
+
+
+class ZabbixClient:
+    """zabbix API client with one pooled keep-alive session, thread safe"""
+
+    def __init__(
+        self,
+        server,
+        user=None,
+        password=None,
+        api_token=None,
+        token_cache=None,
+        token_cache_ttl=3600,
+        pool_size=1,
+        timeout=(5, 5),
+        host_index=None,
+        host_index_warmup=100,
+        username_field="username",
+        url=None,
+        timings=None,
+        retries=2,
+        retry_backoff=0.5,
+        retry_backoff_max=5.0,
+        hedge_after=None,
+        verbose=False,
+        check_cache_ttl=0,
+        max_rps=None,
+        target_latency=2.0,
+    ):
+        # pylint: disable=import-outside-toplevel
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        if api_token is None and (user is None or password is None):
+            raise ValueError('either "api_token" or "user" and "password" are needed')
+        self.server = server
+        self.url = url or f"https://{server}/api_jsonrpc.php"
+        self.exceptions = requests.exceptions
+        self.user = user
+        self.password = password
+        self.api_token = api_token
+        self.token_cache = token_cache
+        self.token_cache_ttl = token_cache_ttl
+        self.timeout = timeout
+        self.host_index = host_index
+        self.host_index_warmup = host_index_warmup
+        # zabbix before 5.4 expects "user" instead of "username" for user.login
+        self.username_field = username_field
+        # CallTimings to record every API call
+        self.timings = timings
+        # idempotent calls are retried with exponential backoff (with full jitter) and, with
+        # 'hedge_after', duplicated if there is no response after that many seconds
+        self.retries = retries
+        self.retry_backoff = retry_backoff
+        self.retry_backoff_max = retry_backoff_max
+        self.hedge_after = hedge_after
+        # request complete objects instead of the fields the actions need
+        self.verbose = verbose
+        # results of 'check' are cached locally, every maintenance change clears them
+        self.check_cache = None
+        if check_cache_ttl > 0 and cache_dir() is not None:
+            self.check_cache = CheckCache(self.url, check_cache_ttl)
+        self.hedge_pool = None
+        if hedge_after:
+            # room for the duplicate requests
+            pool_size *= 2
+            # every read of the 'pool_size' callers runs in the pool with its duplicate, a
+            # smaller (default sized) pool would cap the reads and queue the duplicates
+            self.hedge_pool = concurrent.futures.ThreadPoolExecutor(
+                pool_size, thread_name_prefix="hedge"
+            )
+        # parallel requests (fleet mode, broker, hedging) adapt to the capacity of the frontend
+        self.limiter = None
+        if pool_size > 1 or max_rps:
+            self.limiter = AdaptiveLimiter(pool_size, max_rps, target_latency)
+        self.token = None
+        self.login_lock = threading.Lock()
+        # all API calls share one keep-alive session, so only one TCP/TLS handshake is needed
+        self.session = requests.Session()
+        self.session.headers.update({"Content-Type": "application/json-rpc"})
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    @classmethod
+    def from_config(cls, config, pool_size=1, **kwargs):
+        """create a client from the settings of the YAML config"""
+        import sqlite3  # pylint: disable=import-outside-toplevel
+
+        host_index = None
+        if config.get("host_index"):
+            try:
+                host_index = HostIndex(
+                    config["host_index"], int(config.get("host_index_ttl", 86400))
+                )
+            except sqlite3.Error as err:
+                log.warning('Host index "%s" not usable: %s', config["host_index"], err)
+        return cls(
+            config["server"],
+            user=config.get("user"),
+            password=config.get("password"),
+            api_token=config.get("api_token"),
+            token_cache=config.get("token_cache"),
+            token_cache_ttl=int(config.get("token_cache_ttl", 3600)),
+            pool_size=max(int(config.get("pool_size", 1)), pool_size),
+            timeout=(
+                float(config.get("connect_timeout", 5)),
+                float(config.get("read_timeout", 5)),
+            ),
+            host_index=host_index,
+            host_index_warmup=int(config.get("host_index_warmup", 100)),
+            url=config.get("url"),
+            retries=int(config.get("retries", 2)),
+            retry_backoff=float(config.get("retry_backoff", 0.5)),
+            retry_backoff_max=float(config.get("retry_backoff_max", 5)),
+            hedge_after=(
+                float(config["hedge_after"]) if config.get("hedge_after") else None
+            ),
+            check_cache_ttl=int(config.get("check_cache_ttl", 0)),
+            max_rps=float(config["max_rps"]) if config.get("max_rps") else None,
+            target_latency=float(config.get("target_latency", 2)),
+            **kwargs,
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.logout()
+        self.close()
+
+    # --- session ---
+
+    @property
+    def keeps_session(self):
+        """API tokens have no session and cached sessions are kept for the next run"""
+        return self.api_token is not None or bool(self.token_cache)
+
+    def post(self, method, params, auth=None):
+        """post a request and return the decoded response, raises RequestError
+
+        Idempotent methods are retried after connection errors, timeouts and overload
+        responses of the frontend, other methods only if the connection could not be established.
+        """
+        payload = {"jsonrpc": "2.0", "method": method, "params": params, "id": 1}
+        if auth is not None:
+            payload["auth"] = auth
+        body = json.dumps(payload).encode("utf-8")
+        idempotent = method in IDEMPOTENT_METHODS
+        attempt = 0
+        while True:
+            try:
+                if idempotent and self.hedge_after and method != "user.login":
+                    return self.post_hedged(method, body, attempt)
+                return self.post_once(method, body, attempt)
+            except RequestError as err:
+                if attempt >= self.retries or not self.retryable(err.error, idempotent):
+                    raise
+                delay = random.uniform(
+                    0, min(self.retry_backoff_max, self.retry_backoff * 2**attempt)
+                )
+                log.warning(
+                    "Retrying %s in %.2f seconds after %s",
+                    method,
+                    delay,
+                    type(err.error).__name__,
+                )
+                time.sleep(delay)
+                attempt += 1
+
+    def retryable(self, error, idempotent):
+        """check if a request exception is worth a retry"""
+        if isinstance(error, self.exceptions.ConnectTimeout):
+            # the request was not sent
+            return True
+        if not idempotent:
+            return False
+        if isinstance(error, self.exceptions.HTTPError):
+            return error.response is not None and (
+                error.response.status_code in RETRY_STATUS_CODES
+            )
+        return isinstance(
+            error, (self.exceptions.ConnectionError, self.exceptions.Timeout)
+        )
+
+    def post_once(self, method, body, retries=0, hedged=False):
+        """send one request and return the decoded response, raises RequestError"""
+        call_record = CallRecord(
+            self.server,
+            method,
+            time.time(),
+            0.0,
+            len(body),
+            retries=retries,
+            hedged=hedged,
+        )
+        if self.limiter is not None:
+            self.limiter.acquire()
+        started = time.perf_counter()
+        try:
+            r = self.session.post(self.url, data=body, timeout=self.timeout)
+            call_record.response_bytes = len(r.content)
+            r.raise_for_status()
+            data = r.json()
+        except self.exceptions.RequestException as err:
+            call_record.seconds = time.perf_counter() - started
+            call_record.outcome = type(err).__name__
+            self.record(call_record)
+            if self.limiter is not None:
+                # the errors which are retried for reads are signs of an overloaded frontend
+                self.limiter.release(call_record.seconds, self.retryable(err, True))
+            raise RequestError(err) from err
+        call_record.seconds = time.perf_counter() - started
+        if self.limiter is not None:
+            self.limiter.release(call_record.seconds)
+        if session_terminated(data):
+            call_record.outcome = "session_terminated"
+        elif "error" in data:
+            call_record.outcome = "api_error"
+        self.record(call_record)
+        return data
+
+    def post_hedged(self, method, body, retries=0):
+        """send a read request and a duplicate if there is no response after 'hedge_after'
+        seconds, returns the first successful response, raises RequestError"""
+        futures = [self.hedge_pool.submit(self.post_once, method, body, retries)]
+        done, _ = concurrent.futures.wait(futures, timeout=self.hedge_after)
+        if not done:
+            futures.append(
+                self.hedge_pool.submit(self.post_once, method, body, retries, True)
+            )
+        error = None
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                return future.result()
+            except RequestError as err:
+                error = err
+        raise error
+
+    def record(self, call_record):
+        """pass the record of an API call to the timings"""
+        if self.timings is not None:
+            self.timings.record(call_record)
+
+    def call(self, method, params):
+        """call an API method with authentication and return its result,
+        a terminated (cached or long running) session is renewed once with a new login,
+        raises ZabbixError and RequestError"""
+        try:
+            auth = self.authenticate()
+            data = self.post(method, params, auth)
+            if self.api_token is None and session_terminated(data):
+                with self.login_lock:
+                    # another thread may have renewed the session already
+                    if self.token == auth:
+                        self.token = self.login()
+                data = self.post(method, params, self.token)
+            return api_result(data)
+        finally:
+            # also after errors, a failed request may have changed maintenances
+            if method in MAINTENANCE_WRITE_METHODS and self.check_cache is not None:
+                self.check_cache.clear()
+
+    def authenticate(self):
+        """return the API token, a cached session token or login the user"""
+        if self.api_token is not None:
+            return reveal(self.api_token)
+        with self.login_lock:
+            if self.token is None and self.token_cache:
+                self.token = self.read_token_cache()
+            if self.token is None:
+                self.token = self.login()
+            return self.token
+
+    def login(self):
+        """login user and return the session token"""
+        data = self.post(
+            "user.login",
+            {self.username_field: self.user, "password": reveal(self.password)},
+        )
+        if "unexpected parameter" in str(data.get("error", {}).get("data")):
+            # zabbix before 5.4 only knows "user", since 6.4 only "username"
+            self.username_field = (
+                "user" if self.username_field == "username" else "username"
+            )
+            data = self.post(
+                "user.login",
+                {self.username_field: self.user, "password": reveal(self.password)},
+            )
+        token = api_result(data)
+        if self.token_cache:
+            self.write_token_cache(token)
+        return token
+
+    def logout(self):
+        """Because of user.login, we have to proper logout the user to prevent too many open sessions"""
+        if self.keeps_session or self.token is None:
+            return
+        token, self.token = self.token, None
+        try:
+            self.post("user.logout", [], token)
+        except RequestError as err:
+            log.warning("Logout failed: %s", err)
+
+    def close(self):
+        """close the HTTP session and the host index"""
+        if self.hedge_pool is not None:
+            # a slower duplicate request may still be running
+            self.hedge_pool.shutdown(wait=False, cancel_futures=True)
+        self.session.close()
+        if self.host_index is not None:
+            self.host_index.close()
+
+    def read_token_cache(self):
+        """return the cached session token or None if missing, expired or for another server/user"""
+        try:
+            with open(self.token_cache, "r", encoding="utf-8") as cachefile:
+                cache = json.load(cachefile)
+        except (OSError, ValueError):
+            return None
+        if (
+            cache.get("server") != self.server
+            or cache.get("user") != self.user
+            or cache.get("expires", 0) < time.time()
+        ):
+            return None
+        return cache.get("token")
+
+    def write_token_cache(self, token):
+        """store the session token readable only for the current user"""
+        try:
+            fd = os.open(self.token_cache, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "w", encoding="utf-8") as cachefile:
+                json.dump(
+                    {
+                        "server": self.server,
+                        "user": self.user,
+                        "token": token,
+                        "expires": int(time.time()) + self.token_cache_ttl,
+                    },
+                    cachefile,
+                )
+        except OSError as err:
+            log.warning('Could not write token cache "%s": %s', self.token_cache, err)
+
+    # --- hosts ---
+
+    def get_host_id(self, host):
+        """get hostid from the host index or zabbix server, None if the host does not exist"""
+        return self.get_host_ids([host]).get(host)
+
+    def get_host_ids(self, hosts):
+        """get hostids of all hosts from the host index and one host.get for the
+        missing/outdated ones, returns dict host: hostid of the existing hosts"""
+        hostids = {}
+        missing = list(hosts)
+        if self.host_index is not None:
+            hostids = self.host_index.lookup(missing)
+            missing = [host for host in hosts if host not in hostids]
+            if len(missing) > self.host_index_warmup:
+                self.warm_host_index()
+                hostids = self.host_index.lookup(list(hosts))
+                missing = []
+        if not missing:
+            return hostids
+        result = self.call(
+            "host.get", {"filter": {"host": missing}, "output": ["hostid", "host"]}
+        )
+        found = {h["host"]: h["hostid"] for h in result}
+        if self.host_index is not None:
+            self.host_index.store(found)
+            self.host_index.forget([host for host in missing if host not in found])
+        hostids.update(found)
+        return hostids
+
+    def warm_host_index(self):
+        """reload the host index with all hosts from one host.get, returns the number of hosts"""
+        result = self.call(
+            "host.get", {"output": ["hostid", "host"], "sortfield": "hostid"}
+        )
+        self.host_index.store(
+            {h["host"]: h["hostid"] for h in result}, replace_all=True
+        )
+        return len(result)
+
+    def forget_hosts(self, hosts):
+        """drop hosts from the host index, e.g. because their hostid may be outdated"""
+        if self.host_index is not None:
+            self.host_index.forget(hosts)
+
+    # --- maintenances ---
+
+    def maintenance_output(self, window=True, hosts=False, groups=False):
+        """params "output" and "select*" of maintenance.get: the name, with 'window' the
+        active window and the timeperiods, with 'hosts' the hostids, with 'groups' the groupids,
+        everything with 'verbose'
+        """
+        if self.verbose:
+            return {
+                "output": "extend",
+                "selectGroups": "extend",
+                "selectHosts": "extend",
+                "selectTimeperiods": "extend",
+            }
+        params = {"output": MAINTENANCE_FIELDS}
+        if window:
+            params["output"] = MAINTENANCE_WINDOW_FIELDS
+            params["selectTimeperiods"] = TIMEPERIOD_FIELDS
+        if hosts:
+            params["selectHosts"] = ["hostid"]
+        if groups:
+            params["selectGroups"] = ["groupid"]
+        return params
+
+    def get_maintenances(self, hostid, name, keyword=None, window=True):
+        """get maintenances of a host with filter on 'name',
+        without 'window' only id and name are requested"""
+        # If keyword is None, then show all maintenance items for specified target host
+        # If keyword is an empty sting (like 'check -k ""'), then show only the item which
+        # matches with hostname in it's name
+        # If keyword is provided (not empty), then search for exact matching name
+        params = {
+            **self.maintenance_output(window),
+            "search": {"name": name},
+            "startSearch": keyword is None,
+            "searchWildcardsEnabled": keyword is not None,
+        }
+        if hostid is not None:
+            params["hostids"] = hostid
+        result = self.call("maintenance.get", params)
+        return [Maintenance.from_api(m) for m in result]
+
+    def get_scope_maintenances(self, name, groupids=None, window=True):
+        """get the maintenances of host groups or templates with exactly the name 'name'
+        (see 'scope_maintenance_name'), with 'groupids' only the ones assigned to exactly
+        these groups"""
+        result = self.call(
+            "maintenance.get",
+            {
+                **self.maintenance_output(window, groups=groupids is not None),
+                "filter": {"name": name},
+            },
+        )
+        maintenances = [Maintenance.from_api(m) for m in result if m["name"] == name]
+        if groupids is not None:
+            wanted = {str(g) for g in groupids}
+            maintenances = [m for m in maintenances if set(m.groupids) == wanted]
+        return maintenances
+
+    def resolve_host(self, host, keyword=None, window=True, timeperiods=True):
+        """get the hostid and the maintenances of a host (same name matching as
+        'get_maintenances') with one API call, returns (None, []) if the host does not exist
+
+        With 'timeperiods' (start) or 'verbose' one maintenance.get by name selects the hosts
+        and the timeperiods, host.get is only needed for the hostid if no maintenance matches.
+        Without (stop, check) one host.get selects the ids, names and with 'window' the active
+        window of the maintenances of the host. With a hostid from the host index only the
+        maintenance.get of 'get_maintenances' is needed."""
+        if self.host_index is not None:
+            hostid = self.host_index.lookup([host]).get(host)
+            if hostid is not None:
+                return hostid, self.get_maintenances(
+                    hostid, maintenance_name(host, keyword), keyword, window=window
+                )
+        if (window and timeperiods) or self.verbose:
+            result = self.call(
+                "maintenance.get",
+                {
+                    **self.maintenance_output(window),
+                    "selectHosts": "extend" if self.verbose else ["hostid", "host"],
+                    "search": {"name": maintenance_name(host, keyword)},
+                    "startSearch": keyword is None,
+                    "searchWildcardsEnabled": keyword is not None,
+                },
+            )
+            hostid = None
+            maintenances = []
+            for m in result:
+                # the name search also finds the maintenances of hosts with a longer name
+                hostids = [h["hostid"] for h in m.get("hosts", []) if h["host"] == host]
+                if hostids:
+                    hostid = hostids[0]
+                    maintenances.append(Maintenance.from_api(m))
+            if hostid is None:
+                hostid = self.get_host_id(host)
+            elif self.host_index is not None:
+                self.host_index.store({host: hostid})
+            return hostid, maintenances
+        fields = MAINTENANCE_WINDOW_FIELDS if window else MAINTENANCE_FIELDS
+        result = self.call(
+            "host.get",
+            {
+                "filter": {"host": [host]},
+                "output": ["hostid", "host"],
+                "selectMaintenances": fields,
+            },
+        )
+        if not result:
+            self.forget_hosts([host])
+            return None, []
+        hostid = result[0]["hostid"]
+        if self.host_index is not None:
+            self.host_index.store({host: hostid})
+        return hostid, [
+            Maintenance.from_api(m)
+            for m in sorted(
+                result[0].get("maintenances", []),
+                key=lambda m: int(m["maintenanceid"]),
+            )
+            if maintenance_matches(m["name"], host, keyword)
+        ]
+
+    def get_host_maintenances(self, hostids, keyword=None, window=True):
+        """get maintenances of multiple hosts with one maintenance.get,
+        returns dict host: [Maintenance] with the same name matching as 'get_maintenances'
+        """
+        result = self.call(
+            "maintenance.get",
+            {
+                **self.maintenance_output(window, hosts=True),
+                "hostids": list(hostids.values()),
+                "search": {"name": "maintenance_"},
+                "startSearch": True,
+            },
+        )
+        maintenances = {host: [] for host in hostids}
+        hosts_by_id = {}
+        for host, hostid in hostids.items():
+            hosts_by_id.setdefault(hostid, []).append(host)
+        for m in map(Maintenance.from_api, result):
+            for hostid in m.hostids:
+                for host in hosts_by_id.get(hostid, []):
+                    if maintenance_matches(m.name, host, keyword):
+                        maintenances[host].append(m)
+        return maintenances
+
+    def get_groups(self, names=None, groupids=None):
+        """resolve host groups by name and/or id with one hostgroup.get,
+        returns dict groupid: name of the existing groups"""
+        params = {"output": ["groupid", "name"]}
+        if names and groupids:
+            # the filters of the API are combined with AND
+            params["searchByAny"] = True
+            params["filter"] = {"name": list(names), "groupid": list(groupids)}
+        elif names:
+            params["filter"] = {"name": list(names)}
+        else:
+            params["groupids"] = list(groupids or [])
+        result = self.call("hostgroup.get", params)
+        return {g["groupid"]: g["name"] for g in result}
+
+    def get_template_hosts(self, templates):
+        """resolve templates by name with one template.get,
+        returns dict template: [hostid] of the existing templates"""
+        result = self.call(
+            "template.get",
+            {
+                "output": ["templateid", "host"],
+                "selectHosts": ["hostid"],
+                "filter": {"host": list(templates)},
+            },
+        )
+        return {t["host"]: [h["hostid"] for h in t.get("hosts", [])] for t in result}
+
+    def get_all_maintenances(self, name="maintenance_"):
+        """get all maintenances whose name starts with 'name' (with their window, timeperiods,
+        hostids, groupids and description) with one maintenance.get"""
+        params = self.maintenance_output(window=True, hosts=True, groups=True)
+        if params["output"] != "extend":
+            params["output"] = params["output"] + ["description"]
+        result = self.call(
+            "maintenance.get",
+            {**params, "search": {"name": name}, "startSearch": True},
+        )
+        return [Maintenance.from_api(m) for m in result]
+
+    def iter_maintenance_pages(
+        self, name="maintenance_", page_size=PAGE_SIZE, fields=None
+    ):
+        """yield all maintenances whose name starts with 'name' as lists of at most 'page_size'
+        maintenance.get objects (with hosts, groups and timeperiods, with 'fields' only these
+        fields) sorted by id, the API has no offset, so the ids are fetched first and then the
+        objects page by page
+        """
+        maintenanceids = [
+            m["maintenanceid"]
+            for m in self.call(
+                "maintenance.get",
+                {
+                    "output": ["maintenanceid"],
+                    "search": {"name": name},
+                    "startSearch": True,
+                    "sortfield": "maintenanceid",
+                },
+            )
+        ]
+        if fields is not None:
+            params = {"output": fields}
+        elif self.verbose:
+            params = self.maintenance_output()
+        else:
+            params = {
+                "output": MAINTENANCE_WINDOW_FIELDS,
+                "selectHosts": ["hostid", "host"],
+                "selectGroups": ["groupid", "name"],
+                "selectTimeperiods": TIMEPERIOD_FIELDS,
+            }
+        for start in range(0, len(maintenanceids), page_size):
+            yield self.call(
+                "maintenance.get",
+                {
+                    **params,
+                    "maintenanceids": maintenanceids[start : start + page_size],
+                    "sortfield": "maintenanceid",
+                    "limit": page_size,
+                },
+            )
+
+    def maintenance_exists(self, maintenanceid):
+        """check if a maintenance id exists"""
+        return bool(
+            self.call(
+                "maintenance.get",
+                {"output": ["maintenanceid"], "maintenanceids": maintenanceid},
+            )
+        )
+
+    def create_maintenances(self, maintenances):
+        """create maintenance objects with one maintenance.create,
+        'maintenances' is a list of dicts with name, hostids or groupids, since, till and period
+        (a one time period starting now) or timeperiods and optional description
+        """
+        return self.call(
+            "maintenance.create",
+            [
+                {
+                    "name": m["name"],
+                    "active_since": m["since"],
+                    "active_till": m["till"],
+                    **{
+                        key: m[key]
+                        for key in ("hostids", "groupids", "description")
+                        if m.get(key) is not None
+                    },
+                    "timeperiods": m.get("timeperiods")
+                    or [{"period": m["period"], "timeperiod_type": 0}],
+                }
+                for m in maintenances
+            ],
+        )
+
+    def update_maintenances(self, params):
+        """update maintenance objects with one maintenance.update"""
+        return self.call("maintenance.update", params)
+
+    def delete_maintenances(self, maintenanceids, batch_size=PAGE_SIZE):
+        """delete maintenance objects with one maintenance.delete per 'batch_size' ids"""
+        maintenanceids = list(maintenanceids)
+        deleted = []
+        for start in range(0, len(maintenanceids), batch_size):
+            result = self.call(
+                "maintenance.delete", maintenanceids[start : start + batch_size]
+            )
+            deleted.extend(result["maintenanceids"])
+        return {"maintenanceids": deleted}
+
+
+def session_terminated(data):
+    """check if the API rejected the session token"""
+    if "error" not in data:
+        return False
+    details = f"{data['error'].get('message')} {data['error'].get('data')}"
+    return "Session terminated" in details or "Not authori" in details
+
+
+def api_result(data):
+    """return the result of an API response, raises ZabbixError"""
+    if "error" in data:
+        error = data["error"]
+        raise ZabbixError(error["code"], error["message"], error.get("data"))
+    return data["result"]
+
+
+# --- actions ---
+
+
+def check(client, host, keyword=None):
+    """list the maintenances of a host, from the check cache of the client if it is enabled"""
+    result = ActionResult(host)
+    # the cache has no complete objects for 'verbose'
+    cache = None if client.verbose else client.check_cache
+    cached = cache.get(host, keyword) if cache is not None else None
+    if cached is not None:
+        hostid, maintenances = cached
+    else:
+        # the cache needs "active_till" to expire the entry when a maintenance ends
+        hostid, maintenances = client.resolve_host(
+            host, keyword, window=cache is not None, timeperiods=False
+        )
+        if hostid is None:
+            return result.fail(2, f'Host "{host}" not found!')
+        if cache is not None:
+            cache.put(host, keyword, hostid, maintenances)
+    list_maintenances(
+        result,
+        f'Host "{host}" with hostid "{hostid}"',
+        maintenances,
+        client.verbose,
+    )
+    return result
+
+
+def stop(client, host, keyword=None, delete_all=False, maintenanceid=None):
+    """delete the maintenance of a host (or the maintenance with 'maintenanceid')"""
+    result = ActionResult(host)
+    if maintenanceid is not None:
+        if not client.maintenance_exists(maintenanceid):
+            return result.fail(
+                2, f"Maintenance with id {maintenanceid} was not found!."
+            )
+        delete_maintenances(client, result, [maintenanceid])
+        return result
+    hostid, maintenances = client.resolve_host(host, keyword, window=False)
+    if hostid is None:
+        return result.fail(2, f'Host "{host}" not found!')
+    list_maintenances(
+        result, f'Host "{host}" with hostid "{hostid}"', maintenances, client.verbose
+    )
+    return stop_maintenances(client, result, maintenances, delete_all)
+
+
+def start(client, host, keyword=None, period=3600, schedule=None, until=None):
+    """create a maintenance for a host or extend the existing one,
+    with 'schedule' a recurring maintenance (see 'start_maintenance')"""
+    result = ActionResult(host)
+    name = maintenance_name(host, keyword)
+    hostid, maintenances = client.resolve_host(host, keyword)
+    if hostid is None:
+        return result.fail(2, f'Host "{host}" not found!')
+    list_maintenances(
+        result, f'Host "{host}" with hostid "{hostid}"', maintenances, client.verbose
+    )
+    return start_maintenance(
+        client,
+        result,
+        f'host "{host}"',
+        {"name": name, "hostids": [hostid]},
+        maintenances,
+        period,
+        schedule,
+        until,
+    )
+
+
+def start_maintenance(
+    client, result, target, maintenance, maintenances, period, schedule=None, until=None
+):
+    """create 'maintenance' (dict with name and hostids or groupids) if there are no
+    'maintenances' yet or extend the existing one, with 'schedule' (a recurring timeperiod)
+    the maintenance gets this schedule until 'until' (see 'schedule_params')"""
+    since, till = maintenance_window(period)
+    if schedule is not None and len(maintenances) < 2:
+        existing = maintenances[0] if maintenances else None
+        params = schedule_params(existing, schedule, until)
+        if params is None:
+            result.add(
+                f'Maintenance "{existing.name}" on {target} already has the schedule, nothing to do.'
+            )
+        elif existing is None:
+            client.create_maintenances(
+                [
+                    {
+                        **maintenance,
+                        "since": params["active_since"],
+                        "till": params["active_till"],
+                        "timeperiods": params["timeperiods"],
+                    }
+                ]
+            )
+            result.add(
+                f"Added a {format_schedule(schedule)} until "
+                f'{format_time(params["active_till"])} on {target}'
+            )
+        else:
+            client.update_maintenances(params)
+            result.add(
+                f'Changed maintenance "{existing.name}" to a {format_schedule(schedule)} until '
+                f'{format_time(params["active_till"])} on {target}'
+            )
+    elif not maintenances:
+        client.create_maintenances(
+            [{**maintenance, "since": since, "till": till, "period": period}]
+        )
+        result.add(f"Added a {format_period(period)} hour maintenance on {target}")
+    elif len(maintenances) == 1:
+        # extend the existing maintenance in place, so the hosts never leave maintenance
+        existing = maintenances[0]
+        if existing.covers(since, till):
+            result.add(
+                f'Maintenance "{existing.name}" on {target} '
+                "already covers the period, nothing to do."
+            )
+        else:
+            client.update_maintenances(existing.extend_params(since, till, period))
+            result.add(
+                f'Extended maintenance "{existing.name}" with a {format_period(period)} '
+                f"hour period on {target}"
+            )
+    else:
+        result.fail(
+            1,
+            "Multiple maintenance items was found, "
+            'please use "--keyword, -k" to specify your request.\n',
+        )
+    return result
+
+
+def stop_maintenances(client, result, maintenances, delete_all=False):
+    """delete the found maintenance, or all of them with 'delete_all'"""
+    if not maintenances:
+        result.add("Nothing to do.")
+    elif len(maintenances) == 1 or delete_all:
+        delete_maintenances(client, result, [m.maintenanceid for m in maintenances])
+    else:
+        result.fail(
+            1,
+            "Multiple maintenance items was found, "
+            'please use "--keyword, -k" or "--delete-all, -rm" to specify your request.\n',
+        )
+    return result
+
+
+def group_action(
+    client,
+    action,
+    groups=None,
+    groupids=None,
+    keyword=None,
+    period=3600,
+    delete_all=False,
+    schedule=None,
+    until=None,
+):
+    """start, stop or check one maintenance for host groups (by name or id),
+    the maintenance is assigned to the groups, not to their hosts"""
+    result = ActionResult(None)
+    found = client.get_groups(groups, groupids)
+    missing = [g for g in groups or [] if g not in found.values()]
+    missing += [str(g) for g in groupids or [] if str(g) not in found]
+    for group in missing:
+        result.fail(2, f'Host group "{group}" not found!')
+    if missing:
+        return result
+    names = sorted(set(found.values()))
+    result.host = ", ".join(names)
+    target = f'host group(s) "{result.host}"'
+    name = scope_maintenance_name("group", names, keyword)
+    # unlike for hosts the name is matched exactly, "-g A" must not find the
+    # maintenance of "A" and "B" or the one of "A" with a keyword
+    maintenances = client.get_scope_maintenances(
+        name, groupids=list(found), window=action == "start"
+    )
+    list_maintenances(
+        result, target[0].upper() + target[1:], maintenances, client.verbose
+    )
+    match action:
+        case "check":
+            return result
+        case "stop":
+            return stop_maintenances(client, result, maintenances, delete_all)
+        case _:
+            return start_maintenance(
+                client,
+                result,
+                target,
+                {"name": name, "groupids": sorted(found, key=int)},
+                maintenances,
+                period,
+                schedule,
+                until,
+            )
+
+
+def template_action(
+    client,
+    action,
+    templates,
+    keyword=None,
+    period=3600,
+    delete_all=False,
+    schedule=None,
+    until=None,
+):
+    """start, stop or check one maintenance for all hosts linked to templates"""
+    result = ActionResult(", ".join(sorted(templates)))
+    found = client.get_template_hosts(templates)
+    for template in templates:
+        if template not in found:
+            result.fail(2, f'Template "{template}" not found!')
+    if result.exit_code:
+        return result
+    hostids = sorted({h for ids in found.values() for h in ids}, key=int)
+    target = f'the {len(hostids)} host(s) of template(s) "{result.host}"'
+    name = scope_maintenance_name("template", templates, keyword)
+    maintenances = client.get_scope_maintenances(name, window=action == "start")
+    list_maintenances(
+        result, f'Template(s) "{result.host}"', maintenances, client.verbose
+    )
+    match action:
+        case "check":
+            return result
+        case "stop":
+            return stop_maintenances(client, result, maintenances, delete_all)
+        case _:
+            if not hostids:
+                return result.fail(2, f'No hosts linked to template(s) "{result.host}"')
+            return start_maintenance(
+                client,
+                result,
+                target,
+                {"name": name, "hostids": hostids},
+                maintenances,
+                period,
+                schedule,
+                until,
+            )
+
+
+def list_maintenances(result, target, maintenances, verbose=False):
+    """add the found maintenances to the output, with 'verbose' the complete objects"""
+    if not maintenances:
+        result.add(f"{target} has no maintenance defined.")
+        return
+    result.add("Follow maintenance item(s) was found:")
+    for m in maintenances:
+        result.add(f"{m.maintenanceid}: {m.name}")
+        if verbose:
+            result.add(json.dumps(m.data, indent=4))
+
+
+def delete_maintenances(client, result, maintenanceids):
+    """delete maintenances with bulk calls and report each of them"""
+    client.delete_maintenances(maintenanceids)
+    for maintenanceid in maintenanceids:
+        result.add(
+            f'Successfully deleted maintenance object with maintenanceid "{maintenanceid}"'
+        )
+
+
+def error_lines(err):
+    """output lines for an API or request error"""
+    if isinstance(err, ZabbixError):
+        return [str(err), f"\t Details: {err.data}"]
+    return [
+        "An error occured during the request:",
+        f"\t Type: {type(getattr(err, 'error', err)).__name__}",
+        f"\t Message: {err}",
+    ]
+
+
+def run_action(
+    client,
+    action,
+    host,
+    keyword=None,
+    period=3600,
+    delete_all=False,
+    maintenanceid=None,
+    schedule=None,
+    until=None,
+):
+    """start, stop or check maintenance for a single host, API and request errors
+    are reported in the result with exit code 1"""
+    try:
+        match action:
+            case "check":
+                return check(client, host, keyword)
+            case "stop":
+                return stop(client, host, keyword, delete_all, maintenanceid)
+            case "start":
+                return start(client, host, keyword, period, schedule, until)
+            case _:
+                return ActionResult(host).fail(1, f'Unknown action "{action}"')
+    except ClientError as err:
+        # a hostid from the index may be outdated, resolve it again next time
+        client.forget_hosts([host])
+        result = ActionResult(host, exit_code=1)
+        result.lines.extend(error_lines(err))
+        return result
+
+
+def run_bulk(
+    client,
+    action,
+    hosts,
+    keyword=None,
+    period=3600,
+    delete_all=False,
+    schedule=None,
+    until=None,
+):
+    """start, stop or check maintenance for all hosts with bulk API calls,
+    with 'schedule' a recurring maintenance (see 'start_maintenance'),
+    raises ZabbixError and RequestError"""
+    result = ActionResult(None)
+    since, till = maintenance_window(period)
+    hostids = client.get_host_ids(hosts)
+    for host in hosts:
+        if host not in hostids:
+            result.fail(2, f'Host "{host}" not found!')
+    if not hostids:
+        return result
+    maintenances = client.get_host_maintenances(
+        hostids, keyword, window=action == "start"
+    )
+
+    to_delete = []
+    to_update = []
+    to_create = []
+    for host, hostid in hostids.items():
+        found = maintenances[host]
+        if not found:
+            result.add(
+                f'Host "{host}" with hostid "{hostid}" has no maintenance defined.'
+            )
+        else:
+            result.add(f'Follow maintenance item(s) was found for host "{host}":')
+            for m in found:
+                result.add(f"{m.maintenanceid}: {m.name}")
+                if client.verbose:
+                    result.add(json.dumps(m.data, indent=4))
+        match action:
+            case "check":
+                pass
+            case "stop":
+                if not found:
+                    result.add("Nothing to do.")
+                elif len(found) == 1 or delete_all:
+                    to_delete.extend(m.maintenanceid for m in found)
+                else:
+                    result.fail(
+                        1,
+                        f'Multiple maintenance items was found for host "{host}", '
+                        'please use "--keyword, -k" or "--delete-all, -rm" to specify your request.\n',
+                    )
+            case "start":
+                if len(found) > 1:
+                    result.fail(
+                        1,
+                        f'Multiple maintenance items was found for host "{host}", '
+                        'please use "--keyword, -k" to specify your request.\n',
+                    )
+                elif schedule is not None:
+                    params = schedule_params(
+                        found[0] if found else None, schedule, until
+                    )
+                    if params is None:
+                        result.add(
+                            f'Maintenance "{found[0].name}" already has the schedule, nothing to do.'
+                        )
+                    elif found:
+                        to_update.append(params)
+                    else:
+                        to_create.append(
+                            {
+                                "name": maintenance_name(host, keyword),
+                                "hostids": [hostid],
+                                "since": params["active_since"],
+                                "till": params["active_till"],
+                                "timeperiods": params["timeperiods"],
+                            }
+                        )
+                elif not found:
+                    to_create.append(
+                        {
+                            "name": maintenance_name(host, keyword),
+                            "hostids": [hostid],
+                            "since": since,
+                            "till": till,
+                            "period": period,
+                        }
+                    )
+                elif found[0].covers(since, till):
+                    result.add(
+                        f'Maintenance "{found[0].name}" already covers the period, nothing to do.'
+                    )
+                else:
+                    to_update.append(found[0].extend_params(since, till, period))
+
+    try:
+        if to_delete:
+            client.delete_maintenances(to_delete)
+            result.add(f"Successfully deleted {len(to_delete)} maintenance object(s)")
+        if to_update:
+            client.update_maintenances(to_update)
+            if schedule is not None:
+                result.add(
+                    f"Changed {len(to_update)} maintenance object(s) to a "
+                    f"{format_schedule(schedule)}"
+                )
+            else:
+                result.add(
+                    f"Extended {len(to_update)} maintenance object(s) with a "
+                    f"{format_period(period)} hour period"
+                )
+        if to_create:
+            client.create_maintenances(to_create)
+            if schedule is not None:
+                result.add(
+                    f"Added a {format_schedule(schedule)} on {len(to_create)} host(s)"
+                )
+            else:
+                result.add(
+                    f"Added a {format_period(period)} hour maintenance on {len(to_create)} host(s)"
+                )
+    except ClientError:
+        client.forget_hosts(list(hostids))
+        raise
+    return result
+
+
+def gc(client, keyword=None, older_than=0, dry_run=False, batch_size=PAGE_SIZE):
+    """delete the maintenances of the tool (with 'keyword' only the ones with this keyword)
+    which ended more than 'older_than' seconds ago, 'batch_size' at a time,
+    with 'dry_run' they are only listed, raises ZabbixError and RequestError"""
+    result = ActionResult(None)
+    before = int(time.time()) - older_than
+    pattern = maintenance_name("*", keyword).lower()
+    expired = []
+    deleted = 0
+    # maintenance.get can neither filter nor sort by "active_till", so all maintenances
+    # of the tool are walked page by page (by id) and the expired ones are deleted on the way
+    for page in client.iter_maintenance_pages(
+        page_size=batch_size, fields=MAINTENANCE_WINDOW_FIELDS
+    ):
+        for m in map(Maintenance.from_api, page):
+            if m.active_till < before and fnmatch.fnmatchcase(m.name.lower(), pattern):
+                expired.append(m)
+                result.add(
+                    f"{m.maintenanceid}: {m.name} (ended {format_time(m.active_till)})"
+                )
+        while not dry_run and len(expired) >= batch_size:
+            client.delete_maintenances(
+                [m.maintenanceid for m in expired[:batch_size]], batch_size
+            )
+            deleted += batch_size
+            expired = expired[batch_size:]
+    if dry_run:
+        result.add(
+            f"Dry run, {len(expired)} expired maintenance object(s) would be deleted."
+        )
+        return result
+    if expired:
+        client.delete_maintenances([m.maintenanceid for m in expired], batch_size)
+        deleted += len(expired)
+    if deleted:
+        result.add(f"Successfully deleted {deleted} expired maintenance object(s)")
+    else:
+        result.add("No expired maintenances found, nothing to do.")
+    return result
+
+
+def merge_spooled(requests, now=None):
+    """merge spooled start/stop requests (dict path: request) per profile, host and keyword:
+    a stop replaces the earlier starts, the starts after the last stop become one start until
+    their latest end (starts which already ended are dropped), returns a list of operations
+    (dicts with profile, action, host, keyword, period, delete_all and the paths of the merged
+    requests), stops first"""
+    now = int(time.time()) if now is None else now
+    merged = {}
+    for path, request in sorted(requests.items(), key=lambda r: r[1]["submitted"]):
+        key = (request.get("profile"), request["host"], request.get("keyword"))
+        state = merged.setdefault(
+            key, {"stop": False, "delete_all": False, "till": 0, "paths": []}
+        )
+        state["paths"].append(path)
+        if request["action"] == "stop":
+            state["stop"] = True
+            state["delete_all"] = state["delete_all"] or bool(request.get("delete_all"))
+            state["till"] = 0
+        else:
+            state["till"] = max(state["till"], request["submitted"] + request["period"])
+    stops = []
+    starts = []
+    for (profile, host, keyword), state in merged.items():
+        operation = {
+            "profile": profile,
+            "host": host,
+            "keyword": keyword,
+            "paths": state["paths"],
+        }
+        if state["stop"]:
+            stops.append(
+                {**operation, "action": "stop", "delete_all": state["delete_all"]}
+            )
+        if state["till"] > now:
+            # whole minutes, so that more hosts share a period (and a bulk call)
+            period = -(-(state["till"] - now) // 60) * 60
+            starts.append({**operation, "action": "start", "period": period})
+    return stops + starts
+
+
+def run_spooled(client, operations):
+    """run merged spooled operations (see 'merge_spooled') with one 'run_bulk' per action,
+    keyword and period, returns (ActionResult, paths of the requests rejected by zabbix, paths
+    of the requests not sent because zabbix is not reachable)
+
+    A batch rejected by zabbix does not stop the other batches, after a request error the
+    remaining batches are not sent. A request whose operations were only partly sent is
+    pending, it is sent again later (starts and stops can be repeated)."""
+    result = ActionResult(None)
+    batches = {}
+    for operation in operations:
+        key = (
+            operation["action"],
+            operation["keyword"],
+            operation.get("period", 3600),
+            operation.get("delete_all", False),
+        )
+        batches.setdefault(key, []).append(operation)
+    rejected = set()
+    pending = set()
+    for (action, keyword, period, delete_all), batch_operations in batches.items():
+        paths = {path for o in batch_operations for path in o.get("paths", [])}
+        if pending:
+            pending.update(paths)
+            continue
+        try:
+            batch = run_bulk(
+                client,
+                action,
+                [o["host"] for o in batch_operations],
+                keyword,
+                period,
+                delete_all,
+            )
+        except ZabbixError as err:
+            result.lines.extend(error_lines(err))
+            result.exit_code = max(result.exit_code, 1)
+            rejected.update(paths)
+            continue
+        except RequestError as err:
+            result.lines.extend(error_lines(err))
+            result.exit_code = max(result.exit_code, 1)
+            pending.update(paths)
+            continue
+        result.lines.extend(batch.lines)
+        result.exit_code = max(result.exit_code, batch.exit_code)
+    return result, rejected - pending, pending
+
+
+# --- reconcile ---
+
+
+def parse_time(value):
+    """timestamp of a point in time of a desired state file: epoch seconds, a datetime
+    (parsed by YAML) or an ISO 8601 string, local time without time zone"""
+    if isinstance(value, datetime):
+        return int(value.timestamp())
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return int(value)
+    if isinstance(value, str):
+        return int(datetime.fromisoformat(value).timestamp())
+    raise ValueError(f'invalid point in time "{value}"')
+
+
+def as_names(value):
+    """a name or a list of names of a desired state file as a list of strings"""
+    if isinstance(value, (list, tuple)):
+        return [str(v) for v in value]
+    return [str(value)]
+
+
+def desired_maintenance(entry, keyword=None):
+    """validate a maintenance of a desired state file, returns a dict with kind ("host",
+    "group" or "template"), targets, name, since, till and period, raises ValueError"""
+    if not isinstance(entry, dict):
+        raise ValueError(f"invalid maintenance {entry!r}")
+    kinds = [key for key in ("host", "groups", "templates") if entry.get(key)]
+    if len(kinds) != 1:
+        raise ValueError(
+            f'maintenance {entry!r} needs exactly one of "host", "groups" or "templates"'
+        )
+    if entry.get("start") is None:
+        raise ValueError(f'maintenance {entry!r} needs a "start"')
+    since = parse_time(entry["start"])
+    if entry.get("end") is not None:
+        period = parse_time(entry["end"]) - since
+        if period <= 0:
+            raise ValueError(f'maintenance {entry!r} ends before its "start"')
+        hours_to_period(period / 3600)
+    else:
+        period = hours_to_period(float(entry.get("hours", 1)))
+    targets = as_names(entry[kinds[0]])
+    if kinds[0] == "host":
+        kind, name = "host", maintenance_name(targets[0], keyword)
+    else:
+        kind = kinds[0][:-1]
+        targets = sorted(set(targets))
+        name = scope_maintenance_name(kind, targets, keyword)
+    return {
+        "kind": kind,
+        "targets": targets,
+        "name": name,
+        "since": since,
+        "till": since + period,
+        "period": period,
+    }
+
+
+def load_desired_state(path):
+    """load a desired state file (YAML or JSON) with a list "maintenances" and an optional
+    "keyword", returns (keyword, [desired maintenance]), raises FileNotFoundError and ValueError
+    """
+    import yaml  # pylint: disable=import-outside-toplevel
+
+    with open(path, "r", encoding="utf-8") as statefile:
+        try:
+            state = yaml.load(statefile, Loader=yaml.SafeLoader)
+        except yaml.YAMLError as err:
+            raise ValueError(f'"{path}" is no valid YAML or JSON: {err}') from err
+    if not isinstance(state, dict) or not isinstance(state.get("maintenances"), list):
+        raise ValueError(f'"{path}" needs a list "maintenances"')
+    keyword = str(state["keyword"]) if state.get("keyword") else None
+    desired = [desired_maintenance(entry, keyword) for entry in state["maintenances"]]
+    seen = set()
+    for d in desired:
+        if d["name"] in seen:
+            raise ValueError(f'maintenance "{d["name"]}" is defined more than once')
+        seen.add(d["name"])
+    return keyword, desired
+
+
+def reconcile_description(keyword):
+    """description which marks the maintenances reconciled with 'keyword' as owned by it"""
+    return f"Managed by zabbix_maintenance reconcile, keyword: {keyword}"
+
+
+def plan_reconcile(desired, existing, keyword=None, prune_all=False):
+    """diff desired maintenances (with resolved "hostids" or "groupids") against the existing
+    ones, existing maintenances of the scope which are not desired are deleted: with 'keyword'
+    only the ones created or updated by a reconcile with this keyword (their description, see
+    'reconcile_description'), without only with 'prune_all' all of them, returns a ReconcilePlan
+    """
+    plan = ReconcilePlan()
+    by_name = {m.name: m for m in existing}
+    # without keyword the descriptions are left as they are
+    description = reconcile_description(keyword) if keyword else None
+    for d in desired:
+        params = {
+            "active_since": d["since"],
+            "active_till": d["till"],
+            "hostids": sorted(d.get("hostids", []), key=int),
+            "groupids": sorted(d.get("groupids", []), key=int),
+            "timeperiods": [
+                {"timeperiod_type": 0, "period": d["period"], "start_date": d["since"]}
+            ],
+        }
+        if description is not None:
+            params["description"] = description
+        m = by_name.pop(d["name"], None)
+        if m is None:
+            plan.create.append({"name": d["name"], **params})
+        elif (
+            m.active_since == d["since"]
+            and m.active_till == d["till"]
+            and sorted(m.hostids, key=int) == params["hostids"]
+            and sorted(m.groupids, key=int) == params["groupids"]
+            and [timeperiod_params(tp) for tp in m.timeperiods] == params["timeperiods"]
+            and m.description == params.get("description", m.description)
+        ):
+            plan.unchanged.append(d["name"])
+        else:
+            plan.update.append({"maintenanceid": m.maintenanceid, **params})
+    for m in by_name.values():
+        if m.description == description if keyword else prune_all:
+            plan.delete.append(m)
+    return plan
+
+
+def reconcile(client, desired, keyword=None, dry_run=False, prune_all=False):
+    """bring the maintenances of the tool on the server to the desired state
+    (see 'load_desired_state') with at most one maintenance.delete, maintenance.update and
+    maintenance.create, with 'dry_run' only the plan is shown, raises ZabbixError and RequestError
+
+    Without 'keyword' the desired state would replace every maintenance of the tool, this is
+    refused unless 'prune_all' is set."""
+    result = ActionResult(None)
+    if not keyword and not prune_all:
+        return result.fail(
+            1,
+            'A desired state without "keyword" would delete all other maintenances, '
+            'add a "keyword" or use "--prune-all".',
+        )
+    # the resolved ids are added to copies, the desired state may be used for several servers
+    desired = [dict(d) for d in desired]
+    targets = {"host": set(), "group": set(), "template": set()}
+    for d in desired:
+        targets[d["kind"]].update(d["targets"])
+    hostids = client.get_host_ids(sorted(targets["host"])) if targets["host"] else {}
+    groupids = {
+        name: groupid
+        for groupid, name in (
+            client.get_groups(sorted(targets["group"])) if targets["group"] else {}
+        ).items()
+    }
+    template_hosts = (
+        client.get_template_hosts(sorted(targets["template"]))
+        if targets["template"]
+        else {}
+    )
+    for kind, label, found in (
+        ("host", "Host", hostids),
+        ("group", "Host group", groupids),
+        ("template", "Template", template_hosts),
+    ):
+        for target in sorted(targets[kind]):
+            if target not in found:
+                result.fail(2, f'{label} "{target}" not found!')
+    for d in desired:
+        if result.exit_code:
+            break
+        match d["kind"]:
+            case "host":
+                d["hostids"] = [hostids[d["targets"][0]]]
+            case "group":
+                d["groupids"] = [groupids[name] for name in d["targets"]]
+            case _:
+                d["hostids"] = sorted(
+                    {h for name in d["targets"] for h in template_hosts[name]}, key=int
+                )
+                if not d["hostids"]:
+                    result.fail(2, f'No hosts linked to the templates of "{d["name"]}"')
+    if result.exit_code:
+        return result.fail(result.exit_code, "Nothing changed.")
+
+    plan = plan_reconcile(desired, client.get_all_maintenances(), keyword, prune_all)
+    for params in plan.create:
+        result.add(
+            f'Create "{params["name"]}" {format_time(params["active_since"])} - '
+            f'{format_time(params["active_till"])}'
+        )
+    for params in plan.update:
+        result.add(
+            f'Update maintenanceid "{params["maintenanceid"]}" to '
+            f'{format_time(params["active_since"])} - {format_time(params["active_till"])}'
+        )
+    for m in plan.delete:
+        result.add(f'Delete "{m.name}" with maintenanceid "{m.maintenanceid}"')
+    result.add(
+        f"Plan: {len(plan.create)} to create, {len(plan.update)} to update, "
+        f"{len(plan.delete)} to delete, {len(plan.unchanged)} unchanged, "
+        f"{plan.api_calls} API call(s) to apply"
+    )
+    if dry_run:
+        result.add("Dry run, nothing changed.")
+        return result
+    if plan.delete:
+        client.delete_maintenances([m.maintenanceid for m in plan.delete])
+    if plan.update:
+        client.update_maintenances(plan.update)
+    if plan.create:
+        client.create_maintenances(
+            [
+                {
+                    "name": params["name"],
+                    "since": params["active_since"],
+                    "till": params["active_till"],
+                    "hostids": params["hostids"] or None,
+                    "groupids": params["groupids"] or None,
+                    "timeperiods": params["timeperiods"],
+                    "description": params.get("description"),
+                }
+                for params in plan.create
+            ]
+        )
+    result.add("Plan applied." if plan.api_calls else "Nothing to do.")
+    return result
+
+
+async def run_fleet_async(client, action, hosts, concurrency, on_result=None, **kwargs):
+    """run the single host action for all hosts with at most 'concurrency' hosts at the same time,
+    'on_result' is called with every ActionResult as soon as it is finished,
+    returns dict host: ActionResult"""
+    import asyncio  # pylint: disable=import-outside-toplevel
+
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(concurrency)
+    # the default executor of asyncio has at most 32 (usually fewer) threads
+    executor = concurrent.futures.ThreadPoolExecutor(
+        concurrency, thread_name_prefix="fleet"
+    )
+
+    async def run_host(host):
+        async with semaphore:
+            return await loop.run_in_executor(
+                executor, lambda: run_action(client, action, host, **kwargs)
+            )
+
+    results = {}
+    try:
+        for finished in asyncio.as_completed([run_host(host) for host in hosts]):
+            result = await finished
+            results[result.host] = result
+            if on_result is not None:
+                on_result(result)
+    finally:
+        executor.shutdown(wait=False)
+    return results
+
+
+def run_fleet(client, action, hosts, concurrency, on_result=None, **kwargs):
+    """synchronous wrapper of 'run_fleet_async'"""
+    import asyncio  # pylint: disable=import-outside-toplevel
+
+    return asyncio.run(
+        run_fleet_async(client, action, hosts, concurrency, on_result, **kwargs)
+    )
@@ -3,14 +3,45 @@
 """Set maintenance for host"""
 
 import argparse
+import concurrent.futures
+import json as json_lib
 import os
+import platform
+import signal
+import socket
+import socketserver
 import sys
+import threading
 import time
-import socket
-import platform
-from datetime import datetime, timedelta
-import yaml
-import requests
+from zabbix_maintenance_lib import (
+    ActionResult,
+    CallTimings,
+    ClientError,
+    Spool,
+    ZabbixClient,
+    cache_dir,
+    default_hostname,
+    error_lines,
+    gc,
+    group_action,
+    hours_to_period,
+    load_config,
+    load_desired_state,
+    maintenance_record,
+    merge_spooled,
+    parse_time,
+    reconcile,
+    recurring_timeperiod,
+    run_action,
+    run_bulk,
+    run_fleet,
+    run_spooled,
+    select_profiles,
+    server_profiles,
+    template_action,
+)
+
+RUN_STARTED = time.perf_counter()
 
 # --- argument parser ---
 parser = argparse.ArgumentParser(
@@ -18,7 +49,10 @@ parser = argparse.ArgumentParser(
     "stop or check maintenance for a specific host on zabbix"
 )
 parser.add_argument(
-    "action", choices=["start", "stop", "check"], help="Action to perform"
+    "action",
+    choices=["start", "stop", "check", "reconcile", "gc", "flush", "serve"],
+    help='Action to perform ("reconcile" applies a desired state file, "gc" deletes expired maintenances, '
+    '"flush" sends the requests queued with "--spool", "serve" runs the maintenance broker)',
 )
 parser.add_argument(
     "--time-period",
@@ -26,15 +60,46 @@ parser.add_argument(
     nargs="?",
     type=float,
     default=None,
-    help="Number of hours for maintenance (only for start/stop). Maximum is 148159 hours.",
+    help="Number of hours for maintenance (only for start/stop). Maximum is 148159 hours. "
+    'For "gc" only maintenances which ended at least this many hours ago are deleted (default 0).',
 )
 parser.add_argument(
     "--target-host",
     "-s",
-    nargs="?",
+    action="append",
     type=str,
     default=None,
-    help="Target host to set or check maintenance",
+    help="Target host to set or check maintenance. Can be repeated to target multiple hosts.",
+)
+parser.add_argument(
+    "--hosts-file",
+    "-f",
+    type=str,
+    default=None,
+    help='File with one target host per line, use "-" to read the list from stdin.',
+)
+parser.add_argument(
+    "--group",
+    "-g",
+    action="append",
+    type=str,
+    default=None,
+    help="Target host group (name), can be repeated. One maintenance is created for the host groups "
+    "instead of one per host.",
+)
+parser.add_argument(
+    "--groupids",
+    action="append",
+    type=str,
+    default=None,
+    help='Target host group ids (comma separated), like "--group, -g".',
+)
+parser.add_argument(
+    "--template",
+    action="append",
+    type=str,
+    default=None,
+    help="Target all hosts linked to this template, can be repeated. One maintenance is created for the hosts.",
 )
 parser.add_argument(
     "--config-file",
@@ -67,364 +132,948 @@ parser.add_argument(
     default=None,
     help='Use this argument to delete maintenance object with it\'s id (see "check" action to list all found ids per host).',
 )
+parser.add_argument(
+    "--all",
+    action="store_true",
+    help='List all maintenances of this tool ("maintenance_*") with their hosts, groups and periods as one '
+    'JSON object per line. Works only for "check" action.',
+)
+parser.add_argument(
+    "--schedule",
+    choices=["daily", "weekly", "monthly"],
+    default=None,
+    help='Make "start" a recurring maintenance of "--time-period, -t" hours instead of a one time period, '
+    'it stays active until "--until" and is removed with "stop".',
+)
+parser.add_argument(
+    "--at",
+    type=str,
+    default="00:00",
+    help='Start time (HH:MM, local time of the zabbix server) of a recurring maintenance (default "00:00").',
+)
+parser.add_argument(
+    "--days",
+    type=str,
+    default=None,
+    help='Days of the week of a weekly or monthly schedule, comma separated (e.g. "sat,sun").',
+)
+parser.add_argument(
+    "--day",
+    type=int,
+    default=None,
+    help="Day of the month of a monthly schedule (instead of --days).",
+)
+parser.add_argument(
+    "--every",
+    type=int,
+    default=1,
+    help="Every this many days (daily) or weeks (weekly), for monthly with --days the week of the month "
+    "(1-4, 5 is the last week), default 1.",
+)
+parser.add_argument(
+    "--months",
+    type=str,
+    default=None,
+    help='Months of a monthly schedule, comma separated (e.g. "jan,jul", default all).',
+)
+parser.add_argument(
+    "--until",
+    type=str,
+    default=None,
+    help='End of a recurring maintenance (e.g. "2027-06-30", default one year or the current end).',
+)
+parser.add_argument(
+    "--spool",
+    action="store_true",
+    help="Queue start/stop in the local spool and return at once, a background flusher sends the queued "
+    'requests (merged and in bulk) as soon as zabbix is reachable (see "flush" action).',
+)
+parser.add_argument(
+    "--retry",
+    action="store_true",
+    help='With "flush": send again with exponential backoff until the spool is empty, for at most '
+    '"spool_retry_for" seconds (used by the background flusher).',
+)
+parser.add_argument(
+    "--state-file",
+    type=str,
+    default=None,
+    help='Desired state file (YAML or JSON) for the "reconcile" action.',
+)
+parser.add_argument(
+    "--dry-run",
+    "-n",
+    action="store_true",
+    help='Only show the plan of "reconcile" and its number of API calls or the maintenances "gc" would delete.',
+)
+parser.add_argument(
+    "--prune-all",
+    action="store_true",
+    help='Let "reconcile" with a state file without "keyword" delete every other maintenance of this tool.',
+)
+parser.add_argument(
+    "--verbose",
+    "-v",
+    action="store_true",
+    help="Request and show the complete maintenance objects (by default only the fields the action needs "
+    "are requested).",
+)
+parser.add_argument(
+    "--concurrency",
+    "-j",
+    type=int,
+    default=None,
+    help="Process multiple target hosts one by one with this many hosts in parallel "
+    "(instead of bulk API calls).",
+)
+parser.add_argument(
+    "--broker",
+    "-b",
+    nargs="?",
+    type=str,
+    const="",
+    default=None,
+    help='Send the request to a running broker (started with the "serve" action) or listen on this address '
+    'for "serve". Unix socket path or "host:port" (default on Windows "127.0.0.1:10059", '
+    'on Linux "/run/zabbix/zabbix_maintenance.sock")',
+)
+parser.add_argument(
+    "--profile",
+    "-p",
+    action="append",
+    type=str,
+    default=None,
+    help='Server profile of the config file ("servers") to use, can be repeated to process several servers '
+    'in parallel, "all" selects all profiles (default "default_servers" of the config file or all profiles).',
+)
+parser.add_argument(
+    "--refresh-host-index",
+    action="store_true",
+    help="Reload the local host index with all hosts from zabbix (needs 'host_index' in the config file).",
+)
+parser.add_argument(
+    "--timings",
+    action="store_true",
+    help="Print the number, latency and size of the API calls per method (on stderr) at the end.",
+)
+parser.add_argument(
+    "--trace",
+    type=str,
+    default=None,
+    help="Append a JSON line with method, latency, bytes, retries and outcome of each API call to this file.",
+)
+parser.add_argument(
+    "--textfile",
+    type=str,
+    default=None,
+    help="Write the API call metrics to this file for the textfile collector of node_exporter "
+    '(e.g. "/var/lib/node_exporter/textfile_collector/zabbix_maintenance.prom").',
+)
 args = parser.parse_args()
 
 
-# --- variables ---
-# determine config file path
-if args.config_file is not None:
-    CONFIG_PATH = args.config_file
-elif platform.system() == "Windows":
-    CONFIG_PATH = r"C:\ProgramData\zabbix\zabbix_maintenance.yml"
-elif platform.system() == "Linux":
-    CONFIG_PATH = "/etc/zabbix/zabbix_maintenance.yml"
+# --- broker client ---
+# with '--broker' the request is handed over to a running broker ('serve' action),
+# which holds an authenticated session, so there is no config loading or login here
+if platform.system() == "Windows":
+    DEFAULT_BROKER = "127.0.0.1:10059"
 else:
-    CONFIG_PATH = "/etc/zabbix/zabbix_maintenance.yml"
+    DEFAULT_BROKER = "/run/zabbix/zabbix_maintenance.sock"
+# parallel API calls of the broker, if neither "--concurrency, -j" nor "broker_concurrency" is set
+BROKER_CONCURRENCY = 8
+
+
+def broker_tcp_address(address):
+    """return (host, port) for a "host:port" broker address, None for a unix socket path"""
+    host, sep, port = address.rpartition(":")
+    if sep and port.isdigit() and "/" not in address:
+        return host, int(port)
+    return None
+
+
+def send_to_broker(address, broker_requests):
+    """send requests (one JSON line each) to the broker and print the responses,
+    returns the highest exit code"""
+    tcp_address = broker_tcp_address(address)
+    try:
+        if tcp_address is not None:
+            sock = socket.create_connection(tcp_address)
+        else:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.connect(address)
+    except OSError as err:
+        print(f'Could not connect to broker "{address}": {err}')
+        return 1
+    exit_code = 0
+    with sock, sock.makefile("rw", encoding="utf-8") as brokerfile:
+        for request in broker_requests:
+            brokerfile.write(json_lib.dumps(request) + "\n")
+            brokerfile.flush()
+            line = brokerfile.readline()
+            if not line:
+                print("Broker closed the connection.")
+                return 1
+            response = json_lib.loads(line)
+            print(response["output"], end="")
+            exit_code = max(exit_code, response["exit_code"])
+    return exit_code
+
+
+if args.broker is not None and args.action != "serve":
+    if (
+        args.hosts_file is not None
+        or args.concurrency is not None
+        or args.group
+        or args.groupids
+        or args.template
+        or args.all
+        or args.verbose
+        or args.spool
+        or args.schedule
+        or args.action in ("reconcile", "gc", "flush")
+    ):
+        print(
+            '"--hosts-file, -f", "--concurrency, -j", "--group, -g", "--groupids", "--template", '
+            '"--all", "--verbose, -v", "--spool", "--schedule", "reconcile", "gc" and "flush" '
+            'can not be used with "--broker, -b"'
+        )
+        sys.exit(1)
+    sys.exit(
+        send_to_broker(
+            args.broker or DEFAULT_BROKER,
+            [
+                {
+                    "action": args.action,
+                    "host": host,
+                    "keyword": args.keyword,
+                    "time_period": args.time_period,
+                    "delete_all": args.delete_all,
+                    "id": args.id,
+                }
+                for host in (args.target_host or [None])
+            ],
+        )
+    )
 
-# check if the file exists on 'CONFIG_PATH'
-if os.path.isfile(CONFIG_PATH):
-    CONFIG_FILE = CONFIG_PATH
-else:
-    # use the file in current directory
-    CONFIG_FILE = "zabbix_maintenance.yml"
 
+# --- variables ---
 # load YAML
 try:
-    with open(CONFIG_FILE, "r", encoding="utf-8") as ymlfile:
-        config = yaml.load(ymlfile, Loader=yaml.SafeLoader)
-except FileNotFoundError:
-    print(f'File "{CONFIG_FILE}" not found!')
+    CONFIG_FILE, config = load_config(args.config_file)
+except FileNotFoundError as err:
+    print(f'File "{err.filename}" not found!')
+    sys.exit(2)
+
+# collect target hosts from '--target-host' and '--hosts-file'
+hostnames = list(args.target_host or [])
+if args.hosts_file is not None:
+    try:
+        if args.hosts_file == "-":
+            hostlines = sys.stdin.readlines()
+        else:
+            with open(args.hosts_file, "r", encoding="utf-8") as hostsfile:
+                hostlines = hostsfile.readlines()
+    except FileNotFoundError:
+        print(f'File "{args.hosts_file}" not found!')
+        sys.exit(2)
+    for line in hostlines:
+        line = line.strip()
+        if line and not line.startswith("#") and line not in hostnames:
+            hostnames.append(line)
+
+# more than one host (or a hosts file) switches to bulk mode,
+# or to the fleet mode if a concurrency was provided
+BULK = args.hosts_file is not None or len(hostnames) > 1
+FLEET = BULK and args.concurrency is not None
+if args.concurrency is not None and args.concurrency < 1:
+    print('"--concurrency, -j" must be at least 1')
+    sys.exit(1)
+if BULK and args.id is not None:
+    print('"--id, -i" can not be combined with multiple target hosts')
+    sys.exit(1)
+# host groups or templates as target instead of hosts
+groupids = [
+    groupid.strip()
+    for value in args.groupids or []
+    for groupid in value.split(",")
+    if groupid.strip()
+]
+GROUPS = bool(args.group or groupids)
+if any(not groupid.isdigit() for groupid in groupids):
+    print('"--groupids" must be numeric ids')
+    sys.exit(1)
+if (GROUPS or args.template) and (
+    hostnames or args.hosts_file is not None or args.id is not None
+):
+    print(
+        '"--group, -g", "--groupids" and "--template" can not be combined with target hosts or "--id, -i"'
+    )
+    sys.exit(1)
+if GROUPS and args.template:
+    print('"--group, -g" and "--groupids" can not be combined with "--template"')
+    sys.exit(1)
+if args.all and (
+    args.action != "check"
+    or hostnames
+    or args.hosts_file is not None
+    or GROUPS
+    or args.template
+    or args.id is not None
+):
+    print(
+        '"--all" works only for "check" action and can not be combined with other targets or "--id, -i"'
+    )
+    sys.exit(1)
+if args.action == "reconcile" and (
+    hostnames
+    or args.hosts_file is not None
+    or GROUPS
+    or args.template
+    or args.id is not None
+    or args.keyword is not None
+):
+    print('"reconcile" takes the maintenances and the keyword only from "--state-file"')
+    sys.exit(1)
+if args.spool and (
+    args.action not in ("start", "stop")
+    or GROUPS
+    or args.template
+    or args.id is not None
+    or args.concurrency is not None
+):
+    print(
+        '"--spool" works only for start/stop of hosts and can not be combined with "--id, -i" '
+        'or "--concurrency, -j"'
+    )
+    sys.exit(1)
+if args.action == "flush" and (
+    hostnames or args.hosts_file is not None or GROUPS or args.template
+):
+    print('"flush" sends the queued requests and can not be combined with targets')
+    sys.exit(1)
+if args.action == "gc" and (
+    hostnames
+    or args.hosts_file is not None
+    or GROUPS
+    or args.template
+    or args.id is not None
+):
+    print(
+        '"gc" deletes the expired maintenances of all targets and can not be combined with targets '
+        'or "--id, -i"'
+    )
+    sys.exit(1)
+if args.hosts_file is not None and not hostnames:
+    print("No target hosts found in the hosts list.")
     sys.exit(2)
 
 # get hostname from 'CONFIG_FILE'
-if args.target_host is not None:
-    hostname = args.target_host
-elif "hostname" in config:
-     hostname = config["hostname"]
-else:
-    hostname = socket.getfqdn()
+hostname = hostnames[0] if hostnames else default_hostname(config)
 
-# need PERIOD in seconds for zabbix
-PERIOD = 3600
-if args.time_period is not None:
-    HOURS_ARG = args.time_period
-else:
-    HOURS_ARG = 1
+# need PERIOD in seconds for zabbix, max hours is 148159
+try:
+    PERIOD = hours_to_period(args.time_period if args.time_period is not None else 1)
+except ValueError as err:
+    print(f"Error: {err}")
+    sys.exit(1)
 
-# max hours is 148159
-if HOURS_ARG < 148159:
-    PERIOD = int(HOURS_ARG * 3600)
-else:
-    print("Error: maximum size of a period is 148159 hours")
+# desired maintenances for 'reconcile'
+if args.action == "reconcile":
+    if args.state_file is None:
+        print('"reconcile" needs a desired state file ("--state-file")')
+        sys.exit(1)
+    try:
+        STATE_KEYWORD, desired_state = load_desired_state(args.state_file)
+    except FileNotFoundError:
+        print(f'File "{args.state_file}" not found!')
+        sys.exit(2)
+    except ValueError as err:
+        print(f"Error: {err}")
+        sys.exit(1)
+    if STATE_KEYWORD is None and not args.prune_all:
+        print(
+            f'"{args.state_file}" has no "keyword", "reconcile" would delete all other '
+            'maintenances of this tool, add a "keyword" or use "--prune-all"'
+        )
+        sys.exit(1)
+elif args.prune_all:
+    print('"--prune-all" works only for "reconcile"')
     sys.exit(1)
 
-# set variables from CONFIG_FILE
-user = config["user"]
-password = config["password"]
-server = config["server"]
-API_URL = f"https://{server}/api_jsonrpc.php"
-# set maintenance object name
-# if keyword was provided, use it as suffix in object name
-if args.keyword:
-    MAINTENANCE_NAME = f"maintenance_{hostname}_{args.keyword}"
-else:
-    MAINTENANCE_NAME = f"maintenance_{hostname}"
+# recurring maintenance for 'start'
+SCHEDULE = None
+UNTIL = None
+if args.schedule:
+    if args.action != "start" or args.spool:
+        print(
+            '"--schedule" works only for "start" and can not be combined with "--spool"'
+        )
+        sys.exit(1)
+    try:
+        SCHEDULE = recurring_timeperiod(
+            args.schedule,
+            PERIOD,
+            args.at,
+            args.days.split(",") if args.days else None,
+            args.day,
+            args.every,
+            args.months.split(",") if args.months else None,
+        )
+        if args.until:
+            UNTIL = parse_time(args.until)
+    except ValueError as err:
+        print(f"Error: {err}")
+        sys.exit(1)
+    if UNTIL is not None and UNTIL <= time.time():
+        print('Error: "--until" is in the past')
+        sys.exit(1)
 
-now = int(time.time())
-until = int(time.mktime((datetime.now() + timedelta(seconds=PERIOD)).timetuple()))
+# server profiles from CONFIG_FILE, several profiles are processed in parallel
+try:
+    profiles = select_profiles(config, args.profile)
+except ValueError as err:
+    print(err)
+    sys.exit(2)
+if args.action == "serve" and len(profiles) > 1:
+    print('"serve" needs exactly one server profile, select it with "--profile, -p"')
+    sys.exit(2)
+
+# local spool for '--spool' and 'flush'
+SPOOL_DIR = config.get("spool_dir")
+if SPOOL_DIR is None and cache_dir() is not None:
+    SPOOL_DIR = os.path.join(cache_dir(), "spool")
+if (args.spool or args.action == "flush") and not SPOOL_DIR:
+    print('"--spool" and "flush" need "spool_dir" in the config file')
+    sys.exit(2)
+# the background flusher retries for this many seconds while zabbix is not reachable,
+# waiting FLUSH_BACKOFF seconds after the first attempt, doubled up to FLUSH_BACKOFF_MAX
+SPOOL_RETRY_FOR = float(config.get("spool_retry_for", 3600))
+FLUSH_BACKOFF = 5
+FLUSH_BACKOFF_MAX = 300
+
+# instrumentation of all API calls
+timings = None
+if args.timings or args.trace or args.textfile:
+    try:
+        timings = CallTimings(args.trace)
+    except OSError as err:
+        print(f'Could not open trace file "{args.trace}": {err}')
+        sys.exit(2)
 
 
 # --- functions ---
 
 
-def handle_zabbix_error(data, critical=False):
-    """Check for zabbix API error"""
-    if "error" in data:
-        error = data["error"]
-        print(f"Zabbix API Error {error['code']}: {error['message']}")
-        print(f"\t Details: {error['data']}")
+def create_client(profile):
+    """API client of a server profile, one pooled keep-alive session for all API calls,
+    raises ValueError without credentials"""
+    pool_size = args.concurrency or 1
+    if args.action == "serve" and args.concurrency is None:
+        # the broker answers its clients in parallel
+        pool_size = int(profile.get("broker_concurrency", BROKER_CONCURRENCY))
+    return ZabbixClient.from_config(
+        profile,
+        pool_size=pool_size,
+        timings=timings,
+        verbose=args.verbose,
+    )
 
-        if critical:
-            logout_user(called_from_error=True)
-            sys.exit(1)
-        logout_user()
-        return True  # error found
-    return False  # no error found
 
+def report_timings(exit_code):
+    """print the timing summary and write the textfile of the API calls"""
+    if timings is None:
+        return
+    timings.close()
+    if args.timings:
+        for line in timings.summary_lines():
+            print(line, file=sys.stderr)
+    if args.textfile:
+        try:
+            timings.write_textfile(
+                args.textfile,
+                {"action": args.action},
+                time.perf_counter() - RUN_STARTED,
+                exit_code,
+            )
+        except OSError as err:
+            print(f'Could not write textfile "{args.textfile}": {err}', file=sys.stderr)
 
-def handle_request_exception(err):
-    """handle errors for requests"""
-    print("An error occured during the request:")
-    print(f"\t Type: {type(err).__name__}")
-    print(f"\t Message: {err}")
-    sys.exit(1)
 
+def print_host_result(result, emit=print):
+    """print the output of a host in fleet mode, prefixed with the hostname"""
+    for line in result.output.splitlines():
+        emit(f"[{result.host}] {line}")
+    emit(f"[{result.host}] exit code {result.exit_code}")
 
-def login_api_user():
-    """Login user and return auth token"""
-    headers = {"Content-Type": "application/json-rpc"}
-    json = {
-        "jsonrpc": "2.0",
-        "method": "user.login",
-        "params": {"username": user, "password": password},
-        "id": 1,
-    }
-    try:
-        r = requests.post(API_URL, json=json, headers=headers, timeout=5)
-        r.raise_for_status()
-        data = r.json()
-        if handle_zabbix_error(data, critical=True):
-            return None
-        auth_token = data["result"]
-        return auth_token
-    except (requests.exceptions.HTTPError, requests.exceptions.RequestException) as err:
-        handle_request_exception(err)
-        return None
-
-
-def logout_user(called_from_error=False):
-    """Because of user.login, we have to proper logout the user to prevent too many open sessions"""
-    json = {
-        "jsonrpc": "2.0",
-        "method": "user.logout",
-        "params": [],
-        "auth": token,
-        "id": 1,
-    }
-    headers = {"Content-Type": "application/json-rpc"}
+
+def fleet(client, action, hosts, concurrency, emit=print):
+    """run the single host action for all hosts concurrently, returns the highest exit code"""
+    results = run_fleet(
+        client,
+        action,
+        hosts,
+        concurrency,
+        on_result=lambda result: print_host_result(result, emit),
+        keyword=args.keyword,
+        period=PERIOD,
+        delete_all=args.delete_all,
+        schedule=SCHEDULE,
+        until=UNTIL,
+    )
+    failed = [host for host, result in results.items() if result.exit_code != 0]
+    emit(f"{len(results)} host(s) processed, {len(failed)} failed")
+    for host in failed:
+        emit(f"\t{host}: exit code {results[host].exit_code}")
+    return max((result.exit_code for result in results.values()), default=0)
+
+
+def check_all(client, emit=print):
+    """print all maintenances of the tool as JSON lines, each page as soon as it arrives,
+    returns the exit code, raises ClientError"""
+    for page in client.iter_maintenance_pages():
+        for data in page:
+            emit(json_lib.dumps(maintenance_record(client.server, data, args.verbose)))
+        sys.stdout.flush()
+    return 0
+
+
+def run_on_server(client, emit=print):
+    """run the action with 'client', 'emit' is called with each output line,
+    returns the exit code, raises ClientError"""
+    if args.refresh_host_index:
+        if client.host_index is None:
+            emit(
+                '"--refresh-host-index" needs a usable "host_index" in the config file'
+            )
+            return 2
+        emit(f"Host index reloaded with {client.warm_host_index()} host(s)")
+
+    if args.action == "serve":
+        serve_broker(args.broker or DEFAULT_BROKER)
+        return 0
+    if args.all:
+        return check_all(client, emit)
+    if FLEET:
+        return fleet(client, args.action, hostnames, args.concurrency, emit)
+    if args.action == "reconcile":
+        result = reconcile(
+            client, desired_state, STATE_KEYWORD, args.dry_run, args.prune_all
+        )
+    elif args.action == "gc":
+        result = gc(
+            client,
+            args.keyword,
+            hours_to_period(args.time_period or 0),
+            args.dry_run,
+        )
+    elif GROUPS:
+        result = group_action(
+            client,
+            args.action,
+            args.group,
+            groupids,
+            args.keyword,
+            PERIOD,
+            args.delete_all,
+            SCHEDULE,
+            UNTIL,
+        )
+    elif args.template:
+        result = template_action(
+            client,
+            args.action,
+            args.template,
+            args.keyword,
+            PERIOD,
+            args.delete_all,
+            SCHEDULE,
+            UNTIL,
+        )
+    elif BULK:
+        try:
+            result = run_bulk(
+                client,
+                args.action,
+                hostnames,
+                args.keyword,
+                PERIOD,
+                args.delete_all,
+                SCHEDULE,
+                UNTIL,
+            )
+        except ClientError as err:
+            result = ActionResult(None, 1, error_lines(err))
+    else:
+        result = run_action(
+            client,
+            args.action,
+            hostname,
+            args.keyword,
+            PERIOD,
+            args.delete_all,
+            args.id,
+            SCHEDULE,
+            UNTIL,
+        )
+    for line in result.lines:
+        emit(line)
+    return result.exit_code
+
+
+def run_server_profile(name, profile, emit=None):
+    """run the action on the server of a profile, returns (exit code, output lines),
+    with 'emit' the output is passed to it instead of being returned"""
+    lines = []
     try:
-        r = requests.post(API_URL, json=json, headers=headers, timeout=5)
-        r.raise_for_status()
-        data = r.json()
-
-        if "error" in data and called_from_error:
-            return None
-
-        if handle_zabbix_error(data, critical=False):
-            return None
-        return None
-    except (requests.exceptions.HTTPError, requests.exceptions.RequestException) as err:
-        handle_request_exception(err)
-        return None
-
-
-def get_host_id(host):
-    """get hostid from zabbix server"""
-    json = {
-        "jsonrpc": "2.0",
-        "method": "host.get",
-        "params": {"filter": {"host": host}, "output": "extend"},
-        "auth": token,
-        "id": 1,
-    }
-    headers = {"Content-Type": "application/json-rpc"}
+        client = create_client(profile)
+    except ValueError:
+        return 2, [
+            f'Either "api_token" or "user" and "password" must be set for server profile "{name}"'
+        ]
     try:
-        r = requests.post(API_URL, json=json, headers=headers, timeout=5)
-        r.raise_for_status()
-        data = r.json()
-        if handle_zabbix_error(data, critical=True):
-            return None
-        result = data["result"]
-        if not result:
-            print(f'Host "{hostname}" not found!')
-            logout_user()
-            sys.exit(2)
-        else:
-            hostid = result[0]["hostid"]
-            return hostid
-    except (requests.exceptions.HTTPError, requests.exceptions.RequestException) as err:
-        handle_request_exception(err)
-        return None
-
-
-def get_maintenance_id_check(id):
-    """only to check if the provided maintenance id exists or not"""
-    json = {
-        "jsonrpc": "2.0",
-        "method": "maintenance.get",
-        "params": {
-            "output": "extend",
-            "selectGroups": "extend",
-            "selectTimeperiods": "extend",
-            "maintenanceids": id,
-        },
-        "auth": token,
-        "id": 1,
-    }
-    headers = {"Content-Type": "application/json-rpc"}
+        exit_code = run_on_server(client, emit or lines.append)
+    except ClientError as err:
+        lines.extend(error_lines(err))
+        exit_code = 1
+    finally:
+        client.logout()
+        client.close()
+    return exit_code, lines
+
+
+def run_servers(server_profiles):
+    """run the action on all servers in parallel, the output of a server is printed prefixed
+    with the profile name as soon as it is done, returns the highest exit code
+
+    With "--all" the JSON lines of all servers are printed as they arrive (they contain the
+    server) and the other output goes to stderr."""
+    results = {}
+    print_lock = threading.Lock()
+
+    def locked_print(line):
+        with print_lock:
+            print(line)
+
+    emit = locked_print if args.all else None
+    report = sys.stderr if args.all else sys.stdout
+    with concurrent.futures.ThreadPoolExecutor(len(server_profiles)) as pool:
+        futures = {
+            pool.submit(run_server_profile, name, profile, emit): name
+            for name, profile in server_profiles.items()
+        }
+        for future in concurrent.futures.as_completed(futures):
+            name = futures[future]
+            exit_code, lines = future.result()
+            for line in lines:
+                print(f"[{name}] {line}", file=report)
+            print(f"[{name}] exit code {exit_code}", file=report)
+            results[name] = exit_code
+    failed = [name for name, exit_code in results.items() if exit_code != 0]
+    print(f"{len(results)} server(s) processed, {len(failed)} failed", file=report)
+    for name in failed:
+        print(f"\t{name}: exit code {results[name]}", file=report)
+    return max(results.values())
+
+
+def handle_broker_request(request):
+    """run a broker request and return (exit code, output), identical requests
+    which arrive while the first one is running share its result, different requests
+    for the same host and keyword run one after another, starts which wait for the same
+    host and keyword become one start with the longest period (like in the spool)"""
+    action = request.get("action")
+    if action not in ("start", "stop", "check"):
+        return 1, f'Unknown action "{action}"\n'
+    hours = request.get("time_period")
     try:
-        r = requests.post(API_URL, json=json, headers=headers, timeout=5)
-        r.raise_for_status()
-        data = r.json()
-        if handle_zabbix_error(data, critical=True):
-            return None
-        result = data["result"]
-        if not result:
-            return False
-        else:
-            return True
-    except (requests.exceptions.HTTPError, requests.exceptions.RequestException) as err:
-        handle_request_exception(err)
-        return None
-
-
-def get_maintenance_id(hostid, maintenance_name):
-    """get maintenanceid with filter on 'maintenance_name'"""
-    # If keyword is None, then show all maintenance items for specified target host
-    # If keyword is an empty sting (like 'check -k ""'), then show only the item which
-    # matches with hostname in it's name
-    # If keyword is provided (not empty), then search for exact matching name
-    json = {
-        "jsonrpc": "2.0",
-        "method": "maintenance.get",
-        "params": {
-            "output": "extend",
-            "selectGroups": "extend",
-            "selectTimeperiods": "extend",
-            "hostids": hostid,
-            "search": {"name": maintenance_name},
-            # "startSearch": True if args.keyword is None else False,
-            "startSearch": args.keyword is None,
-            # "searchWildcardsEnabled": False if args.keyword is None else True,
-            "searchWildcardsEnabled": args.keyword is not None,
-        },
-        "auth": token,
-        "id": 1,
-    }
-    headers = {"Content-Type": "application/json-rpc"}
+        period = hours_to_period(1 if hours is None else float(hours))
+    except ValueError as err:
+        return 1, f"Error: {err}\n"
+    host = request.get("host") or hostname
+    keyword = request.get("keyword")
+    delete_all = bool(request.get("delete_all"))
+    key = (action, host, keyword, period, delete_all, request.get("id"))
+    target = (host, keyword)
+    with broker_lock:
+        future = broker_running.get(key)
+        if future is None and action == "start" and target in broker_starts:
+            waiting = broker_starts[target]
+            waiting["period"] = max(waiting["period"], period)
+            future = waiting["future"]
+        owner = future is None
+        if owner:
+            future = concurrent.futures.Future()
+            broker_running[key] = future
+            if action == "start":
+                # later starts for the target join it until it runs
+                waiting = broker_starts[target] = {"period": period, "future": future}
+            # [lock, number of requests using it], dropped by the last one
+            target_lock = broker_targets.setdefault(target, [threading.Lock(), 0])
+            target_lock[1] += 1
+    if not owner:
+        return future.result()
     try:
-        r = requests.post(API_URL, json=json, headers=headers, timeout=5)
-        r.raise_for_status()
-        data = r.json()
-        if handle_zabbix_error(data, critical=True):
-            return None
-        result = data["result"]
-        if not result:
-            print(
-                f'Host "{hostname}" with hostid "{hostid}" has no maintenance defined.'
+        # e.g. "start -t 1" and "stop" at the same time would both see no maintenance
+        # or the one the other is changing, one after another they see each other
+        with target_lock[0]:
+            if action == "start":
+                with broker_lock:
+                    del broker_starts[target]
+                    period = waiting["period"]
+            result = run_action(
+                client, action, host, keyword, period, delete_all, request.get("id")
             )
-            return None
-        # Marco Lucarelli:
-        # maintenanceid = result[0]['maintenanceid']
-        # collect all "maintenanceid", "name" results and create dict
-        maintenanceid = {m["maintenanceid"]: m["name"] for m in result}
-        print("Follow maintenance item(s) was found:")
-        for maintenanceids, maintenancename in maintenanceid.items():
-            print(f"{maintenanceids}: {maintenancename}")
-        return maintenanceid
-    except (requests.exceptions.HTTPError, requests.exceptions.RequestException) as err:
-        handle_request_exception(err)
-        return None
-
-
-def del_maintenance(maintenanceid):
-    """delete existing maintenance object"""
-    json = {
-        "jsonrpc": "2.0",
-        "method": "maintenance.delete",
-        "params": [maintenanceid],
-        "auth": token,
-        "id": 1,
-    }
-    headers = {"Content-Type": "application/json-rpc"}
+        future.set_result((result.exit_code, result.output))
+    except BaseException as err:
+        # waiting requests get the error instead of waiting forever
+        future.set_exception(err)
+        raise
+    finally:
+        with broker_lock:
+            del broker_running[key]
+            target_lock[1] -= 1
+            if not target_lock[1]:
+                del broker_targets[target]
+    return result.exit_code, result.output
+
+
+class BrokerRequestHandler(socketserver.StreamRequestHandler):
+    """read JSON requests line by line and answer each with a JSON line"""
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json_lib.loads(line)
+                exit_code, output = handle_broker_request(request)
+            except (ValueError, TypeError, AttributeError) as err:
+                exit_code, output = 1, f"Invalid request: {err}\n"
+            response = {"exit_code": exit_code, "output": output}
+            self.wfile.write((json_lib.dumps(response) + "\n").encode("utf-8"))
+            self.wfile.flush()
+
+
+def serve_broker(address):
+    """run the broker on 'address' until it is interrupted"""
+    tcp_address = broker_tcp_address(address)
+    if tcp_address is not None:
+        server_class = socketserver.ThreadingTCPServer
+        server_class.allow_reuse_address = True
+        server_address = tcp_address
+    else:
+        server_class = socketserver.ThreadingUnixStreamServer
+        server_address = address
+        if os.path.exists(address):
+            os.remove(address)
+    server_class.daemon_threads = True
+    # stop on SIGTERM (e.g. from systemd) like on Ctrl-C
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
     try:
-        r = requests.post(API_URL, json=json, headers=headers, timeout=5)
-        r.raise_for_status()
-        data = r.json()
-        if handle_zabbix_error(data, critical=True):
-            return None
-        print(
-            f'Successfully deleted maintenance object with maintenanceid "{maintenanceid}"'
-        )
-        return True
-    except (requests.exceptions.HTTPError, requests.exceptions.RequestException) as err:
-        handle_request_exception(err)
-        return None
-
-
-def create_maintenance(maintenance_name, since, till, hostid, timeperiod):
-    """create maintenance object with period"""
-    json = {
-        "jsonrpc": "2.0",
-        "method": "maintenance.create",
-        "params": {
-            "name": maintenance_name,
-            "active_since": since,
-            "active_till": till,
-            "hostids": [hostid],
-            "timeperiods": {"period": timeperiod, "timeperiod_type": 0},
-        },
-        "auth": token,
-        "id": 1,
-    }
-    headers = {"Content-Type": "application/json-rpc"}
+        with server_class(server_address, BrokerRequestHandler) as broker:
+            if tcp_address is None:
+                os.chmod(address, 0o660)
+            print(f'Broker is listening on "{address}"', flush=True)
+            broker.serve_forever()
+    except KeyboardInterrupt:
+        print("Broker stopped.")
+    finally:
+        if tcp_address is None and os.path.exists(address):
+            os.remove(address)
+
+
+def submit_to_spool():
+    """queue the action for the target hosts on all selected servers and start a flusher,
+    returns the exit code"""
     try:
-        r = requests.post(API_URL, json=json, headers=headers, timeout=5)
-        r.raise_for_status()
-        data = r.json()
-        if handle_zabbix_error(data, critical=True):
-            return None
-        print(
-            f'Added a {timeperiod//3600}:{timeperiod%3600//60:02n} hour maintenance on host "{hostname}"'
-        )
-        return True
-    except (requests.exceptions.HTTPError, requests.exceptions.RequestException) as err:
-        handle_request_exception(err)
-        return None
+        spool = Spool(SPOOL_DIR)
+        submitted = int(time.time())
+        for name in profiles:
+            for host in hostnames or [hostname]:
+                spool.submit(
+                    {
+                        "profile": name,
+                        "action": args.action,
+                        "host": host,
+                        "keyword": args.keyword,
+                        "period": PERIOD,
+                        "delete_all": args.delete_all,
+                        "submitted": submitted,
+                    }
+                )
+    except OSError as err:
+        print(f'Could not queue the request in "{SPOOL_DIR}": {err}')
+        return 1
+    print(f'Queued {args.action} for {len(hostnames) or 1} host(s) in "{SPOOL_DIR}"')
+    start_flusher()
+    return 0
 
 
-# --- main ---
+def start_flusher():
+    """start a detached "flush" run, its output is appended to "flush.log" in the spool"""
+    import subprocess  # pylint: disable=import-outside-toplevel
 
-# create auth token
-token = login_api_user()
-
-match args.action:
-    case "check":
-        host_id = get_host_id(hostname)
-        get_maintenance_id(host_id, MAINTENANCE_NAME)
-    case "stop":
-        if args.id is not None:
-            if get_maintenance_id_check(args.id) is True:
-                del_maintenance(args.id)
-            else:
-                print(f"Maintenance with id {args.id} was not found!.")
-                logout_user()
-                sys.exit(2)
-        else:
-            host_id = get_host_id(hostname)
-            maintenance_id = get_maintenance_id(host_id, MAINTENANCE_NAME)
-            match maintenance_id:
-                case None:
-                    print("Nothing to do.")
-                case _ if len(maintenance_id) == 1:
-                    for mid, mname in maintenance_id.items():
-                        del_maintenance(mid)
-                case _ if args.delete_all:
-                    for mid, mname in maintenance_id.items():
-                        del_maintenance(mid)
-                case _:
-                    print(
-                        "Multiple maintenance items was found, "
-                        'please use "--keyword, -k" or "--delete-all, -rm" to specify your request.\n'
-                    )
-                    logout_user()
-                    sys.exit(1)
-    case "start":
-        host_id = get_host_id(hostname)
-        maintenance_id = get_maintenance_id(host_id, MAINTENANCE_NAME)
-        if maintenance_id is None:
-            create_maintenance(MAINTENANCE_NAME, now, until, host_id, PERIOD)
-        elif len(maintenance_id) == 1:
-            for mid, mname in maintenance_id.items():
-                del_maintenance(mid)
-            create_maintenance(MAINTENANCE_NAME, now, until, host_id, PERIOD)
-        else:
+    if getattr(sys, "frozen", False):
+        command = [sys.executable]
+    else:
+        command = [sys.executable, os.path.abspath(__file__)]
+    command += ["flush", "--retry", "-c", os.path.abspath(CONFIG_FILE)]
+    if platform.system() == "Windows":
+        detach = {
+            "creationflags": subprocess.DETACHED_PROCESS
+            | subprocess.CREATE_NEW_PROCESS_GROUP
+        }
+    else:
+        detach = {"start_new_session": True}
+    try:
+        with open(
+            os.path.join(SPOOL_DIR, "flush.log"), "a", encoding="utf-8"
+        ) as logfile:
+            subprocess.Popen(  # pylint: disable=consider-using-with
+                command,
+                stdin=subprocess.DEVNULL,
+                stdout=logfile,
+                stderr=subprocess.STDOUT,
+                **detach,
+            )
+    except OSError as err:
+        print(f'Could not start the flusher, run "flush" later: {err}')
+
+
+def flush_spool():
+    """send the queued requests merged per host and keyword with bulk calls, requests are
+    kept for the next run if zabbix is not reachable, returns (highest exit code, True if
+    requests were kept because zabbix is not reachable or the credentials are missing)
+    """
+    try:
+        spool = Spool(SPOOL_DIR)
+        claimed = spool.claim()
+    except OSError as err:
+        print(f'Could not read the spool "{SPOOL_DIR}": {err}')
+        return 1, False
+    if not claimed:
+        print("No queued requests.")
+        return 0, False
+    all_profiles = server_profiles(config)
+    by_profile = {}
+    for path, request in claimed.items():
+        by_profile.setdefault(request.get("profile"), []).append(path)
+    exit_code = 0
+    kept = False
+    for name, paths in by_profile.items():
+        print(f"[{name}] {len(paths)} queued request(s)")
+        if name not in all_profiles:
+            print(f'[{name}] Unknown server profile, moved to "{spool.failed_path}"')
+            spool.reject(paths)
+            exit_code = max(exit_code, 2)
+            continue
+        try:
+            client = create_client(all_profiles[name])
+        except ValueError:
+            print(f'[{name}] Either "api_token" or "user" and "password" must be set')
+            spool.release(paths)
+            exit_code = max(exit_code, 2)
+            kept = True
+            continue
+        try:
+            result, rejected, pending = run_spooled(
+                client, merge_spooled({p: claimed[p] for p in paths})
+            )
+        finally:
+            client.logout()
+            client.close()
+        for line in result.lines:
+            print(f"[{name}] {line}")
+        if pending:
+            # zabbix is not reachable, the next flush sends them again
+            print(f"[{name}] {len(pending)} request(s) stay queued")
+            spool.release(pending)
+            kept = True
+        if rejected:
             print(
-                "Multiple maintenance items was found, "
-                'please use "--keyword, -k" to specify your request.\n'
+                f'[{name}] {len(rejected)} request(s) rejected by zabbix, moved to "{spool.failed_path}"'
             )
-            logout_user()
-            sys.exit(1)
+            spool.reject(rejected)
+        spool.remove([p for p in paths if p not in pending and p not in rejected])
+        exit_code = max(exit_code, result.exit_code)
+    return exit_code, kept
+
+
+def flush_retrying():
+    """flush until the spool is empty, while zabbix is not reachable with exponential backoff
+    (FLUSH_BACKOFF up to FLUSH_BACKOFF_MAX seconds) for at most 'spool_retry_for' seconds,
+    requests queued during a successful flush are sent at once, only one retrying flusher
+    runs per spool, returns the exit code of the last flush"""
+    try:
+        spool = Spool(SPOOL_DIR)
+    except OSError as err:
+        print(f'Could not read the spool "{SPOOL_DIR}": {err}')
+        return 1
+    deadline = time.monotonic() + SPOOL_RETRY_FOR
+    delay = FLUSH_BACKOFF
+    exit_code = 0
+    while True:
+        if not spool.lock():
+            print("Another flusher sends the queued requests.")
+            return 0
+        try:
+            while True:
+                exit_code, kept = flush_spool()
+                if not spool.queued():
+                    break
+                if not kept:
+                    # new requests arrived while zabbix answered, no reason to wait
+                    delay = FLUSH_BACKOFF
+                    continue
+                if time.monotonic() + delay > deadline:
+                    print(
+                        f"Zabbix was not reachable for {SPOOL_RETRY_FOR:.0f} seconds, "
+                        'the requests stay queued for the next "flush"'
+                    )
+                    return exit_code
+                print(f"Trying again in {delay:.0f} seconds", flush=True)
+                time.sleep(delay)
+                spool.refresh_lock()
+                delay = min(delay * 2, FLUSH_BACKOFF_MAX)
+        finally:
+            spool.unlock()
+        # requests queued by flushers which gave up while the lock was held
+        if not spool.queued():
+            return exit_code
+
+
+# --- main ---
+
+broker_lock = threading.Lock()
+broker_running = {}
+broker_targets = {}
+broker_starts = {}
+
+if args.spool:
+    sys.exit(submit_to_spool())
+if args.action == "flush":
+    EXIT_CODE = flush_retrying() if args.retry else flush_spool()[0]
+    report_timings(EXIT_CODE)
+    sys.exit(EXIT_CODE)
+
+if len(profiles) > 1:
+    EXIT_CODE = run_servers(profiles)
+    report_timings(EXIT_CODE)
+    sys.exit(EXIT_CODE)
+
+# one server: the client is shared with the broker
+try:
+    client = create_client(next(iter(profiles.values())))
+except ValueError:
+    print(f'Either "api_token" or "user" and "password" must be set in "{CONFIG_FILE}"')
+    sys.exit(2)
+
+try:
+    EXIT_CODE = run_on_server(client)
+except ClientError as err:
+    # keep the output of "--all" valid JSON lines
+    print("\n".join(error_lines(err)), file=sys.stderr if args.all else sys.stdout)
+    EXIT_CODE = 1
 
 # always log user out
-logout_user()
+client.logout()
+client.close()
+report_timings(EXIT_CODE)
+sys.exit(EXIT_CODE)